@@ -0,0 +1,250 @@
+import bitboard as bb
+import numpy as np
+import sys
+import time
+
+# The same bit layout as in bitboard.py, stored as one uint64 per game
+BOARD = np.uint64(bb.BOARD)
+START = [np.uint64(bb.WHITE_START), np.uint64(bb.BLACK_START)]
+KING_ROW = [np.uint64(bb.WHITE_KING_ROW), np.uint64(bb.BLACK_KING_ROW)]
+DIRECTIONS = bb.KING_DIRECTIONS
+
+# For each side, the directions in DIRECTIONS that men can move along
+MAN_CAN_MOVE = [[s in bb.MAN_DIRECTIONS[color] for s in DIRECTIONS] for color in ["white","black"]]
+
+# Only the lowest 40 bits are used by the layout, so five bytes per mask are unpacked
+BITS_PER_MASK = 40
+
+WHITE = 0
+BLACK = 1
+DRAW = -1
+
+def shift( masks, s ):
+    """
+    Shift all bits in masks one diagonal step in the direction s
+    """
+    if ( s > 0 ):
+        return (masks << np.uint64(s)) & BOARD
+    return (masks >> np.uint64(-s)) & BOARD
+
+def bitMask( squares ):
+    return np.left_shift( np.uint64(1), squares.astype(np.uint64) )
+
+def canMove( side, own, opp, kings ):
+    """
+    Return for every game whether the side has a step or a jump
+    """
+    empty = BOARD & ~(own|opp)
+    found = np.zeros( len(own), dtype=bool )
+    for d, s in enumerate(DIRECTIONS):
+        movers = own if MAN_CAN_MOVE[side][d] else own & kings
+        found |= (shift(movers, s) & empty) != 0
+        found |= (shift( shift(movers, s) & opp, s ) & empty) != 0
+    return found
+
+class BatchSimulator:
+    """
+    Plays many games between two random players in lockstep. Every game is
+    stored as three uint64 bitboards, and all running games are advanced one
+    turn at a time with vectorized move generation.
+
+    The moves are selected as RandomMover does: a random piece among the
+    pieces that can move, and then a random square among the steps and the
+    landing squares of the capture sequences of that piece.
+    """
+    def __init__( self, numberOfGames, maxTurns=200, seed=None ):
+        self.numberOfGames = numberOfGames
+        self.maxTurns = maxTurns
+        self.rng = np.random.default_rng(seed)
+        self.setupGames()
+
+    def setupGames( self ):
+        n = self.numberOfGames
+        self.pieces = [np.zeros(n, dtype=np.uint64)+START[WHITE], np.zeros(n, dtype=np.uint64)+START[BLACK]]
+        self.kings = np.zeros(n, dtype=np.uint64)
+        self.numberOfTurns = np.zeros(n, dtype=np.int32)
+        self.finished = np.zeros(n, dtype=bool)
+
+        # Game checks if a side can move right after its own move, and the
+        # side loses at its next turn if it could not
+        self.blocked = [np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)]
+
+        # Side of the winner (player 1 plays white), DRAW if nobody won
+        self.winner = np.zeros(n, dtype=np.int8)+DRAW
+        self.sideToMove = WHITE
+
+    def choose( self, masks ):
+        """
+        Select one set bit uniformly in each mask. Returns whether the mask
+        had any bit set and the selected bit as a mask
+        """
+        n = len(masks)
+        raw = masks.astype("<u8").view(np.uint8).reshape(n,8)[:,:BITS_PER_MASK//8]
+        bits = np.unpackbits( raw, axis=1, bitorder="little" )
+        cumulative = np.cumsum( bits, axis=1, dtype=np.int16 )
+        counts = cumulative[:,-1]
+        selected = (self.rng.random(n)*counts).astype(np.int16)
+        bit = np.argmax( cumulative > selected[:,None], axis=1 )
+        found = counts > 0
+        return found, np.where( found, bitMask(bit), np.uint64(0) )
+
+    def captureLandings( self, side, selected, opp, empty, isKing ):
+        """
+        Breadth first search for the capture sequences of the selected piece
+        in every game. Each landing square is only reached once, through the
+        first sequence found. Returns the landing squares of each game, and
+        for every landing square found the game, the square and the captured
+        pieces
+        """
+        n = len(selected)
+        landings = np.zeros( n, dtype=np.uint64 )
+        visited = selected.copy()
+        games = np.arange(n)
+        current = selected.copy()
+        captured = np.zeros( n, dtype=np.uint64 )
+        foundGames = []
+        foundSquares = []
+        foundCaptured = []
+        while ( len(games) > 0 ):
+            nextGames = []
+            nextCurrent = []
+            nextCaptured = []
+            for d, s in enumerate(DIRECTIONS):
+                movers = current if MAN_CAN_MOVE[side][d] else np.where( isKing[games], current, np.uint64(0) )
+                over = shift(movers, s) & opp[games] & ~captured
+                land = shift(over, s) & empty[games] & ~visited[games]
+                jumped = np.flatnonzero( land )
+                if ( len(jumped) == 0 ):
+                    continue
+                g = games[jumped]
+                visited[g] |= land[jumped]
+                landings[g] |= land[jumped]
+                nextGames.append( g )
+                nextCurrent.append( land[jumped] )
+                nextCaptured.append( captured[jumped] | over[jumped] )
+            if ( len(nextGames) == 0 ):
+                break
+            games = np.concatenate(nextGames)
+            current = np.concatenate(nextCurrent)
+            captured = np.concatenate(nextCaptured)
+            foundGames.append( games )
+            foundSquares.append( current )
+            foundCaptured.append( captured )
+        if ( len(foundGames) == 0 ):
+            return landings, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64)
+        return landings, np.concatenate(foundGames), np.concatenate(foundSquares), np.concatenate(foundCaptured)
+
+    def stepGames( self ):
+        """
+        Let the side to move perform one turn in all the running games
+        """
+        side = self.sideToMove
+        games = np.flatnonzero( ~self.finished )
+        own = self.pieces[side][games]
+        opp = self.pieces[1-side][games]
+        kings = self.kings[games]
+        self.numberOfTurns[games] += 1
+
+        # Pieces with a step or a first jump
+        empty = BOARD & ~(own|opp)
+        movable = np.zeros( len(games), dtype=np.uint64 )
+        for d, s in enumerate(DIRECTIONS):
+            movers = own if MAN_CAN_MOVE[side][d] else own & kings
+            movable |= shift( empty, -s ) & movers
+            movable |= shift( shift(empty, -s) & opp, -s ) & movers
+        hasMove, selected = self.choose( movable )
+
+        # A side without moves loses
+        hasMove &= ~self.blocked[side][games]
+        stuck = games[~hasMove]
+        self.finished[stuck] = True
+        self.winner[stuck] = 1-side
+        selected[~hasMove] = 0
+
+        # Steps end on squares an odd number of columns away and capture
+        # sequences on squares an even number of columns away, so they are
+        # selected from one mask
+        isKing = (kings & selected) != 0
+        steps = np.zeros( len(games), dtype=np.uint64 )
+        for d, s in enumerate(DIRECTIONS):
+            movers = selected if MAN_CAN_MOVE[side][d] else np.where( isKing, selected, np.uint64(0) )
+            steps |= shift(movers, s) & empty
+        landings, landingGames, landingSquares, landingCaptured = self.captureLandings( side, selected, opp, empty, isKing )
+        found, target = self.choose( steps | landings )
+
+        captured = np.zeros( len(games), dtype=np.uint64 )
+        match = landingSquares == target[landingGames]
+        captured[landingGames[match]] = landingCaptured[match]
+
+        own ^= selected | target
+        kings ^= np.where( isKing, selected|target, np.uint64(0) )
+        opp &= ~captured
+        kings &= ~captured
+        kings |= own & KING_ROW[side]
+        self.blocked[side][games] = hasMove & ~canMove( side, own, opp, kings )
+        self.pieces[side][games] = own
+        self.pieces[1-side][games] = opp
+        self.kings[games] = kings
+
+        # A side without pieces loses
+        lost = games[hasMove & (opp == 0)]
+        self.finished[lost] = True
+        self.winner[lost] = side
+
+        self.finished[self.numberOfTurns >= self.maxTurns] = True
+        self.sideToMove = 1-side
+
+    def run( self ):
+        """
+        Play all games until they are finished
+        """
+        while ( not np.all(self.finished) ):
+            self.stepGames()
+
+    def outcomes( self ):
+        """
+        Return the number of wins for each player and the number of draws
+        """
+        return {"p1":int(np.sum(self.winner == WHITE)), "p2":int(np.sum(self.winner == BLACK)), "draw":int(np.sum(self.winner == DRAW))}
+
+    def gameLengthHistogram( self, binWidth=10 ):
+        """
+        Return the number of games in bins of binWidth turns and the bin edges
+        """
+        edges = np.arange( 0, self.maxTurns+binWidth, binWidth )
+        counts, edges = np.histogram( self.numberOfTurns, bins=edges )
+        return counts, edges
+
+def main( argv ):
+    if ( len(argv) < 1 or len(argv) > 2 ):
+        print ("Usage: python3 batchSimulator.py <numberOfGames> [batchSize]")
+        return
+
+    numberOfGames = int(argv[0])
+    batchSize = 10000
+    if ( len(argv) == 2 ):
+        batchSize = int(argv[1])
+
+    outcomes = {"p1":0, "p2":0, "draw":0}
+    histogram = 0
+    starttime = time.time()
+    played = 0
+    while ( played < numberOfGames ):
+        simulator = BatchSimulator( min(batchSize, numberOfGames-played) )
+        simulator.run()
+        for key, value in simulator.outcomes().items():
+            outcomes[key] += value
+        counts, edges = simulator.gameLengthHistogram()
+        histogram = histogram + counts
+        played += simulator.numberOfGames
+    diffSec = time.time()-starttime
+
+    print ("Played %d games in %.1f s (%.0f games per minute)"%(played, diffSec, 60.0*played/diffSec))
+    for key in ["p1","p2","draw"]:
+        print ("%4s: %6.2f per cent"%(key, 100.0*outcomes[key]/played))
+    print ("Game length:")
+    for i in range(0,len(histogram)):
+        print ("%3d-%3d: %s %d"%(edges[i], edges[i+1]-1, "#"*int(60*histogram[i]/max(histogram)), histogram[i]))
+
+if __name__ == "__main__":
+    main( sys.argv[1:] )
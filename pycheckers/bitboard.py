@@ -0,0 +1,537 @@
+import game as gm
+import piece as pc
+import numpy as np
+
+# The 32 playable squares (x+y even) are stored as bits in a Python integer.
+# Square (x,y) is mapped to bit (x+9*y)/2. This leaves one unused "ghost" bit
+# after every second row, such that every diagonal step is a pure shift:
+#    (x+1,y+1) -> +5, (x-1,y+1) -> +4, (x+1,y-1) -> -4, (x-1,y-1) -> -5
+# Steps that leave the board end up on a ghost bit or outside the mask.
+NE = 5
+NW = 4
+SE = -4
+SW = -5
+
+def squareToBit( x, y ):
+    return (x+9*y)//2
+
+BIT_TO_SQUARE = {}
+for y in range(0,8):
+    for x in range(y%2,8,2):
+        BIT_TO_SQUARE[squareToBit(x,y)] = (x,y)
+
+BOARD = 0
+for b in BIT_TO_SQUARE.keys():
+    BOARD |= (1 << b)
+
+WHITE_START = 0
+BLACK_START = 0
+for b,(x,y) in BIT_TO_SQUARE.items():
+    if ( y < 3 ):
+        WHITE_START |= (1 << b)
+    elif ( y > 4 ):
+        BLACK_START |= (1 << b)
+
+WHITE_KING_ROW = 0
+BLACK_KING_ROW = 0
+for b,(x,y) in BIT_TO_SQUARE.items():
+    if ( y == 7 ):
+        WHITE_KING_ROW |= (1 << b)
+    elif ( y == 0 ):
+        BLACK_KING_ROW |= (1 << b)
+
+# For a piece on bit b, given by (b, isWhite, isKing), the Zobrist key, the
+# index of the empty feature of the square in the input states and the
+# indices of the feature of the piece seen from white and from black
+SQUARE_UPDATES = {}
+for b,(x,y) in BIT_TO_SQUARE.items():
+    for white in [True,False]:
+        for king in [True,False]:
+            feature = pc.MAN
+            if ( king ):
+                feature = pc.KING
+            whiteFeature = feature
+            blackFeature = feature+2
+            if ( not white ):
+                whiteFeature, blackFeature = blackFeature, whiteFeature
+            indx = 5*(x*8+y)
+            SQUARE_UPDATES[(b,white,king)] = (pc.ZOBRIST_KEYS[x][y][whiteFeature], indx, indx+whiteFeature, indx+blackFeature)
+
+# Direction order used when searching for captures. It is the same order as
+# the pieces in piece.py use, such that both engines select the same jump
+# path when several paths lead to the same square
+MAN_DIRECTIONS = {"white":[NW,NE], "black":[SW,SE]}
+KING_DIRECTIONS = [NE,SE,SW,NW]
+
+def shift( bb, s ):
+    """
+    Shift all bits in bb one diagonal step in the direction s
+    """
+    if ( s > 0 ):
+        return (bb << s) & BOARD
+    return (bb >> -s) & BOARD
+
+def bits( bb ):
+    """
+    Iterate over the indices of the set bits in bb
+    """
+    while ( bb ):
+        low = bb & -bb
+        yield low.bit_length()-1
+        bb ^= low
+
+class CapturePaths:
+    """
+    All capture sequences of one piece. Offers the same interface as
+    CaptureSequences in piece.py
+    """
+    def __init__( self ):
+        self.paths = {}
+
+    def toList( self ):
+        return [[x,y] for (x,y) in self.paths.keys()]
+
+    def getPath( self, x, y ):
+        if ( not (x,y) in self.paths ):
+            raise Exception("Could not find path for the current move!")
+        return [list(BIT_TO_SQUARE[b]) for b in self.paths[(x,y)]]
+
+class BitBoard:
+    """
+    Board where the pieces of each color and the kings are stored as bitmasks.
+    The network input states and the Zobrist hash are kept up to date by
+    makeMove and undoMove, in the same layout as in piece.Board
+    """
+    def __init__( self ):
+        self.white = 0
+        self.black = 0
+        self.kings = 0
+        self.inputStates = {"white":np.zeros(5*64)-0.25, "black":np.zeros(5*64)-0.25}
+        self.hash = 0
+        self.updateDerivedState()
+
+    def setupGame( self ):
+        self.white = WHITE_START
+        self.black = BLACK_START
+        self.kings = 0
+        self.updateDerivedState()
+
+    def updateDerivedState( self ):
+        """
+        Compute the input states and the hash from the bitmasks. Has to be
+        called after the bitmasks are set directly
+        """
+        self.hash = 0
+        for color in pc.COLORS:
+            state = self.inputStates[color]
+            state[:] = -0.25
+            state[0::5] = 1.0
+        for b in bits(self.white|self.black):
+            self.toggleSquare( b, self.white & (1 << b) != 0, self.kings & (1 << b) != 0 )
+
+    def toggleSquare( self, b, white, king ):
+        """
+        Add (or remove) a piece on the square of bit b to (or from) the input
+        states and the hash
+        """
+        key, indx, whiteIndx, blackIndx = SQUARE_UPDATES[(b, white, king != 0)]
+        self.hash ^= key
+
+        # The square is either empty or holds the piece, so the empty feature
+        # and the feature of the piece are swapped between 1.0 and -0.25
+        state = self.inputStates["white"]
+        state[indx] = 0.75-state[indx]
+        state[whiteIndx] = 0.75-state[whiteIndx]
+        state = self.inputStates["black"]
+        state[indx] = 0.75-state[indx]
+        state[blackIndx] = 0.75-state[blackIndx]
+
+    def own( self, color ):
+        if ( color == "white" ):
+            return self.white
+        return self.black
+
+    def opponent( self, color ):
+        if ( color == "white" ):
+            return self.black
+        return self.white
+
+    def empty( self ):
+        return BOARD & ~(self.white | self.black)
+
+    def getPiece( self, x, y ):
+        """
+        Return name and color of the piece at (x,y)
+        """
+        b = 1 << squareToBit(x,y)
+        color = "white"
+        if ( self.black & b ):
+            color = "black"
+        if ( not (self.white|self.black) & b ):
+            return "empty", color
+        elif ( self.kings & b ):
+            return "king", color
+        return "man", color
+
+    def directions( self, bit, color ):
+        if ( self.kings & (1 << bit) ):
+            return KING_DIRECTIONS
+        return MAN_DIRECTIONS[color]
+
+    def capturePaths( self, bit, color ):
+        """
+        Depth first search for all capture sequences starting at bit.
+        Returns a dictionary with the landing bit as key and the bits visited
+        on the way as value.
+        """
+        directions = self.directions(bit, color)
+        opp = self.opponent(color)
+        empty = self.empty()
+        isKing = len(directions) == 4
+        paths = {}
+        visited = 1 << bit
+        # Each stack entry holds the current square, the path leading to it,
+        # the pieces captured on the way and the next direction to check
+        stack = [[bit,[bit],0,0]]
+        while ( len(stack) > 0 ):
+            entry = stack[-1]
+            current, path, captured, i = entry
+            if ( i >= len(directions) ):
+                stack.pop()
+                continue
+            entry[3] += 1
+            s = directions[i]
+            over = shift( 1 << current, s )
+            if ( not over & opp or over & captured ):
+                continue
+            land = shift( over, s )
+            if ( not land & empty ):
+                continue
+            if ( isKing and land & visited ):
+                continue
+            landBit = land.bit_length()-1
+            visited |= land
+            if ( not landBit in paths ):
+                paths[landBit] = path+[landBit]
+            stack.append( [landBit, path+[landBit], captured|over, 0] )
+        return paths
+
+    def validMoves( self, x, y ):
+        """
+        Return the valid moves of the piece at (x,y) in the same format
+        as Piece.validMoves
+        """
+        bit = squareToBit(x,y)
+        name, color = self.getPiece(x,y)
+        if ( name == "empty" ):
+            return [], CapturePaths()
+        moves = []
+        empty = self.empty()
+        for s in self.directions(bit, color):
+            target = shift( 1 << bit, s )
+            if ( target & empty ):
+                moves.append( list(BIT_TO_SQUARE[target.bit_length()-1]) )
+
+        catchMoves = CapturePaths()
+        for landBit, path in self.capturePaths(bit, color).items():
+            catchMoves.paths[BIT_TO_SQUARE[landBit]] = path
+        return moves+catchMoves.toList(), catchMoves
+
+    def hasValidMove( self, x, y ):
+        """
+        Return True if the piece at (x,y) can move or jump
+        """
+        bit = squareToBit(x,y)
+        name, color = self.getPiece(x,y)
+        empty = self.empty()
+        opp = self.opponent(color)
+        for s in self.directions(bit, color):
+            target = shift( 1 << bit, s )
+            if ( target & empty or (target & opp and shift(target, s) & empty) ):
+                return True
+        return False
+
+    def hasLegalMove( self, color ):
+        """
+        Return True if the side has any legal move, using only shifts
+        """
+        movers = self.own(color)
+        kings = movers & self.kings
+        empty = self.empty()
+        opp = self.opponent(color)
+        for s in KING_DIRECTIONS:
+            if ( s in MAN_DIRECTIONS[color] ):
+                pieces = movers
+            else:
+                pieces = kings
+            if ( shift(pieces, s) & empty or shift( shift(pieces, s) & opp, s ) & empty ):
+                return True
+        return False
+
+    def legalMoves( self, color ):
+        """
+        Return all legal moves of one side as (from, to, captured) tuples,
+        where from and to are bit indices and captured is a bitmask
+        """
+        movers = self.own(color)
+        opp = self.opponent(color)
+        empty = self.empty()
+        kings = movers & self.kings
+        menDirections = MAN_DIRECTIONS[color]
+        moves = []
+
+        # Only search for capture sequences from pieces that can jump
+        jumpers = 0
+        for s in KING_DIRECTIONS:
+            if ( s in menDirections ):
+                pieces = movers
+            else:
+                pieces = kings
+                if ( not pieces ):
+                    continue
+            targets = shift(pieces, s) & empty
+            while ( targets ):
+                low = targets & -targets
+                to = low.bit_length()-1
+                moves.append( (to-s,to,0) )
+                targets ^= low
+            jumpers |= shift( shift(empty, -s) & opp, -s ) & pieces
+        for frm in bits(jumpers):
+            for to, path in self.capturePaths(frm, color).items():
+                moves.append( (frm,to,self.capturedMask(path)) )
+        return moves
+
+    def capturedMask( self, path ):
+        """
+        Return a bitmask of the pieces jumped over along path
+        """
+        captured = 0
+        for i in range(0,len(path)-1):
+            captured |= 1 << ((path[i]+path[i+1])//2)
+        return captured
+
+    def makeMove( self, move, color ):
+        """
+        Perform a move returned by legalMoves. Returns the information
+        needed by undoMove
+        """
+        frm, to, captured = move
+        fromMask = 1 << frm
+        toMask = 1 << to
+        capturedKings = self.kings & captured
+        wasKing = self.kings & fromMask
+        white = color == "white"
+        self.toggleSquare( frm, white, wasKing )
+        for b in bits(captured):
+            self.toggleSquare( b, not white, capturedKings & (1 << b) )
+        if ( white ):
+            self.white ^= fromMask | toMask
+            self.black &= ~captured
+            promotion = toMask & WHITE_KING_ROW
+        else:
+            self.black ^= fromMask | toMask
+            self.white &= ~captured
+            promotion = toMask & BLACK_KING_ROW
+        self.kings &= ~(captured|fromMask)
+        if ( wasKing or promotion ):
+            self.kings |= toMask
+        self.toggleSquare( to, white, wasKing or promotion )
+        return (move, color, capturedKings, wasKing)
+
+    def undoMove( self, record ):
+        """
+        Undo a move performed by makeMove
+        """
+        (frm, to, captured), color, capturedKings, wasKing = record
+        fromMask = 1 << frm
+        toMask = 1 << to
+        white = color == "white"
+        self.toggleSquare( to, white, self.kings & toMask )
+        self.toggleSquare( frm, white, wasKing )
+        for b in bits(captured):
+            self.toggleSquare( b, not white, capturedKings & (1 << b) )
+        if ( white ):
+            self.white ^= fromMask | toMask
+            self.black |= captured
+        else:
+            self.black ^= fromMask | toMask
+            self.white |= captured
+        self.kings &= ~toMask
+        self.kings |= capturedKings
+        if ( wasKing ):
+            self.kings |= fromMask
+
+class BitPiece:
+    """
+    Light weight view of a piece on a BitBoard. It offers the attributes
+    and the validMoves function the move policies in game.py rely on
+    """
+    def __init__( self, board, x, y, color ):
+        self.board = board
+        self.x = x
+        self.y = y
+        self.color = color
+        self.name = "man"
+
+    def validMoves( self ):
+        return self.board.validMoves( self.x, self.y )
+
+    def hasValidMove( self ):
+        return self.board.hasValidMove( self.x, self.y )
+
+class BitPieces(list):
+    """
+    The pieces of one player on a BitBoard. game.legalMoves and
+    game.hasAvailableMove use the shift based generators of the whole side
+    instead of searching the moves of every piece. pieceAt maps the bit of
+    every piece on the board, of both players, to the piece
+    """
+    def __init__( self, board, color, pieceAt ):
+        super().__init__()
+        self.board = board
+        self.color = color
+        self.pieceAt = pieceAt
+
+    def legalMoves( self ):
+        """
+        Return the moves of BitBoard.legalMoves as (piece, move, captured).
+        captured is the bitmask of the captured pieces and is passed to
+        BitboardGame.move in place of the catch tree
+        """
+        pieceAt = self.pieceAt
+        return [(pieceAt[frm], list(BIT_TO_SQUARE[to]), captured) for frm, to, captured in self.board.legalMoves(self.color)]
+
+    def hasLegalMove( self ):
+        return self.board.hasLegalMove( self.color )
+
+class BitboardGame(gm.Game):
+    """
+    Game played on a BitBoard. It is used like Game, and the move stack holds
+    records in the layout of Game.moveStack
+    """
+    def __init__( self ):
+        super().__init__()
+        self.board = BitBoard()
+        self.pieceAt = {}
+        for player in [self.p1, self.p2]:
+            player.pieces = BitPieces( self.board, player.color, self.pieceAt )
+            player.setRandomPolicy()
+
+    def addPiece( self, player, b, king=False ):
+        x, y = BIT_TO_SQUARE[b]
+        piece = BitPiece( self.board, x, y, player.color )
+        if ( king ):
+            piece.name = "king"
+        player.pieces.append( piece )
+        self.pieceAt[b] = piece
+
+    def setupGame( self ):
+        """
+        Initialize the game, has to be called before the game is started
+        """
+        self.board.setupGame()
+        for b in bits(self.board.white):
+            self.addPiece( self.p1, b )
+        for b in bits(self.board.black):
+            self.addPiece( self.p2, b )
+
+    def setupPosition( self, rows, colorToMove="white" ):
+        """
+        Initialize the game from a position in the format of Game.setupPosition
+        """
+        self.board.white = 0
+        self.board.black = 0
+        self.board.kings = 0
+        for b,(x,y) in sorted(BIT_TO_SQUARE.items()):
+            if ( rows[y][x] == "." ):
+                continue
+            if ( rows[y][x].lower() == "w" ):
+                self.board.white |= 1 << b
+                self.addPiece( self.p1, b, king=rows[y][x].isupper() )
+            else:
+                self.board.black |= 1 << b
+                self.addPiece( self.p2, b, king=rows[y][x].isupper() )
+            if ( rows[y][x].isupper() ):
+                self.board.kings |= 1 << b
+        self.board.updateDerivedState()
+
+        if ( colorToMove == self.p1.color ):
+            self.playerToMove = self.p1
+        else:
+            self.playerToMove = self.p2
+
+    def opponentOf( self, player ):
+        if ( player == self.p1 ):
+            return self.p2
+        return self.p1
+
+    def move( self, pieceToMove, newPosition, catchTree ):
+        """
+        Move a piece. catchTree is either the bitmask of the captured pieces
+        given by BitPieces.legalMoves or the CapturePaths of the piece, so the
+        capture sequences are not searched again
+        """
+        if ( pieceToMove is None ):
+            return
+        frm = squareToBit( pieceToMove.x, pieceToMove.y )
+        to = squareToBit( newPosition[0], newPosition[1] )
+        if ( isinstance(catchTree, CapturePaths) ):
+            captured = 0
+            if ( (newPosition[0],newPosition[1]) in catchTree.paths ):
+                captured = self.board.capturedMask( catchTree.paths[(newPosition[0],newPosition[1])] )
+        else:
+            captured = catchTree
+        opponent = self.opponentOf(self.playerToMove)
+
+        # Cheap sanity check instead of generating the moves of the piece
+        isStep = captured == 0 and to-frm in self.board.directions(frm, pieceToMove.color) and shift(1 << frm, to-frm) != 0
+        if ( not self.board.own(pieceToMove.color) & (1 << frm) or not self.board.empty() & (1 << to) or
+        captured & ~self.board.own(opponent.color) or not (isStep or captured) ):
+            raise Exception("The suggested move %s is not valid for the %s at (%d,%d)"%(str(newPosition), pieceToMove.name, pieceToMove.x, pieceToMove.y))
+
+        removed = []
+        for b in bits(captured):
+            piece = self.pieceAt.pop(b)
+            opponent.pieces.remove(piece)
+            removed.append(piece)
+
+        wasKing = self.board.kings & (1 << frm)
+        fromX = pieceToMove.x
+        fromY = pieceToMove.y
+        self.board.makeMove( (frm,to,captured), pieceToMove.color )
+        del self.pieceAt[frm]
+        self.pieceAt[to] = pieceToMove
+        pieceToMove.x = newPosition[0]
+        pieceToMove.y = newPosition[1]
+        promoted = not wasKing and self.board.kings & (1 << to) != 0
+        if ( promoted ):
+            pieceToMove.name = "king"
+        self.moveStack.append( (pieceToMove, fromX, fromY, removed, promoted, opponent) )
+
+    def undoMove( self ):
+        """
+        Undo the last move on the move stack. The record of BitBoard.undoMove
+        is rebuilt from the entry of the move stack
+        """
+        pieceMoved, fromX, fromY, piecesRemoved, promoted, opponent = self.moveStack.pop()
+        captured = 0
+        capturedKings = 0
+        for piece in piecesRemoved:
+            b = squareToBit(piece.x,piece.y)
+            captured |= 1 << b
+            if ( piece.name == "king" ):
+                capturedKings |= 1 << b
+            self.pieceAt[b] = piece
+        frm = squareToBit( fromX, fromY )
+        to = squareToBit( pieceMoved.x, pieceMoved.y )
+        wasKing = 0
+        if ( pieceMoved.name == "king" and not promoted ):
+            wasKing = 1 << frm
+        self.board.undoMove( ((frm,to,captured), pieceMoved.color, capturedKings, wasKing) )
+        del self.pieceAt[to]
+        self.pieceAt[frm] = pieceMoved
+        pieceMoved.x = fromX
+        pieceMoved.y = fromY
+        if ( promoted ):
+            pieceMoved.name = "man"
+        opponent.pieces += piecesRemoved
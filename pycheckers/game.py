@@ -1,6 +1,37 @@
 import piece as pc
 import numpy as np
 import neuralNetwork as nn
+import time
+import transpositionTable as tt
+
+# Row where the men of each side are promoted to kings
+PROMOTION_ROW = [7,0]
+
+def legalMoves( pieces ):
+    """
+    Return all legal moves of the pieces as a list of (piece, move, catchTree).
+    Piece lists that generate the moves of the whole side at once (see
+    bitboard.BitPieces) are asked directly
+    """
+    if ( hasattr(pieces, "legalMoves") ):
+        return pieces.legalMoves()
+    moves = []
+    for piece in pieces:
+        valid, catchTree = piece.validMoves()
+        for move in valid:
+            moves.append( (piece, move, catchTree) )
+    return moves
+
+def hasAvailableMove( pieces ):
+    """
+    Return True as soon as one of the pieces is found to have a valid move
+    """
+    if ( hasattr(pieces, "hasLegalMove") ):
+        return pieces.hasLegalMove()
+    for piece in pieces:
+        if ( piece.hasValidMove() ):
+            return True
+    return False
 
 class Player:
     """
@@ -23,7 +54,13 @@ class Player:
         """
         The player should base its move on a neural network
         """
-        self.movePolicy = CleverMover( self.pieces, network, game )
+        self.movePolicy = CleverMover( self.pieces, network, game, self.color )
+
+    def setAlphaBetaSearch( self, evaluator, game, maxDepth=4, timeLimit=None, transpositionTable=None ):
+        """
+        The player should search for the best move with alpha-beta search
+        """
+        self.movePolicy = AlphaBetaMover( self.pieces, evaluator, game, maxDepth=maxDepth, timeLimit=timeLimit, transpositionTable=transpositionTable )
 
     def setRandomPolicy( self ):
         """
@@ -39,22 +76,28 @@ class MovePolicy():
         self.state = "OK"
         self.pieces = pieces
 
+        # Set from another thread to make a running getMove return early
+        self.stopRequested = False
+
     def getMove( self ):
         """
         Return the selected move
         """
         raise NotImplementedError( "Childs have to implement this function!" )
 
+    def requestStop( self ):
+        """
+        Ask a running getMove to return its best move so far as soon as
+        possible. Policies that always return quickly ignore the request
+        """
+        self.stopRequested = True
+
     def checkForAvailableMoves( self ):
         """
-        Return True if the player has available moves
+        Set the state to noAvailableMoves if the player has no available moves
         """
-        moves = []
-        for piece in self.pieces:
-            moves, tree = piece.validMoves()
-            if ( len(moves) > 0 ):
-                return
-        self.state = "noAvailableMoves"
+        if ( not hasAvailableMove(self.pieces) ):
+            self.state = "noAvailableMoves"
 
 class RandomMover(MovePolicy):
     """
@@ -66,18 +109,18 @@ class RandomMover(MovePolicy):
 
     def getMove( self ):
         """
-        Returns a random, but valid move
+        Returns a random, but valid move. A random piece among the pieces that
+        can move is selected, and then a random move of that piece
         """
-        maxIter = 1000
-        for i in range(0,maxIter):
-            pieceIndx = np.random.randint(0, high=len(self.pieces) )
-            validMoves, catchTree = self.pieces[pieceIndx].validMoves()
-            if ( len(validMoves) == 0 ):
-                continue
-            moveIndx = np.random.randint(0,high=len(validMoves))
-            return self.pieces[pieceIndx], validMoves[moveIndx], catchTree
-        self.state = "noAvailableMoves"
-        return None,[],None
+        movesOfPiece = {}
+        for candidate in legalMoves( self.pieces ):
+            movesOfPiece.setdefault( candidate[0], [] ).append( candidate )
+        if ( len(movesOfPiece) == 0 ):
+            self.state = "noAvailableMoves"
+            return None,[],None
+        movable = list(movesOfPiece.values())
+        moves = movable[np.random.randint(0, high=len(movable))]
+        return moves[np.random.randint(0,high=len(moves))]
 
 class HumanUser(MovePolicy):
     """
@@ -132,11 +175,12 @@ class Game:
         self.maxTurns = 200
         self.numberOfTurns = 0
 
-        # Keep track of the last moves performed
-        self.pieceMoved = None
-        self.piecesRemoved = []
-        self.movedFrom = []
-        self.newKing = None
+        # Every game owns its board such that several games can exist at the same time
+        self.board = pc.Board()
+
+        # Every move performed is pushed on the stack as
+        # (pieceMoved, fromX, fromY, piecesRemoved, promoted, opponent)
+        self.moveStack = []
 
         self.state = "playing"
 
@@ -151,6 +195,14 @@ class Game:
         else:
             print ("Ended with draw!")
 
+    def hashKey( self ):
+        """
+        Zobrist hash of the current position including the side to move
+        """
+        if ( self.playerToMove.color == "black" ):
+            return self.board.hash ^ pc.ZOBRIST_BLACK_TO_MOVE
+        return self.board.hash
+
     def setupGame( self ):
         """
         Initialize the game, has to be called before the game is started
@@ -159,10 +211,7 @@ class Game:
         # Fill board with empty
         for i in range(0,8):
             for j in range(0,8):
-                newpiece = pc.Piece()
-                newpiece.x = i
-                newpiece.y = j
-                pc.Piece.board.setPiece( newpiece )
+                self.board.clearSquare( i, j )
 
         # Create the pieces of player 1 and player 2
         # Each has 4*3 = 12 pieces
@@ -170,32 +219,67 @@ class Game:
             indx = 2*i
             y = int(indx/8)
             x = indx%8 + y%2
-            self.p1.pieces.append( pc.Man() )
+            self.p1.pieces.append( pc.Man(self.board, side=pc.WHITE) )
             self.p1.pieces[-1].x = x
             self.p1.pieces[-1].y = y
-            self.p1.pieces[-1].color = "white"
 
 
             y = 7-int(indx/8)
             x = (indx+1)%8 - int(indx/8)%2
-            self.p2.pieces.append( pc.Man() )
+            self.p2.pieces.append( pc.Man(self.board, side=pc.BLACK) )
             self.p2.pieces[-1].x = x
             self.p2.pieces[-1].y = y
-            self.p2.pieces[-1].color = "black"
 
             # Put pieces on the board
-            pc.Piece.board.setPiece( self.p1.pieces[-1] )
-            pc.Piece.board.setPiece( self.p2.pieces[-1] )
-            #pc.Piece.board.printOut()
+            self.board.setPiece( self.p1.pieces[-1] )
+            self.board.setPiece( self.p2.pieces[-1] )
+            #self.board.printOut()
+
+        #self.board.printOut()
+
+    def setupPosition( self, rows, colorToMove="white" ):
+        """
+        Initialize the game from a position. rows[y][x] is one of "." (empty),
+        "w" (white man), "W" (white king), "b" (black man) or "B" (black king)
+        """
+        for x in range(0,8):
+            for y in range(0,8):
+                self.board.clearSquare( x, y )
+                if ( rows[y][x] == "." ):
+                    continue
+                if ( rows[y][x].lower() == "w" ):
+                    player = self.p1
+                    side = pc.WHITE
+                else:
+                    player = self.p2
+                    side = pc.BLACK
+                if ( rows[y][x].isupper() ):
+                    piece = pc.King(self.board, side=side)
+                else:
+                    piece = pc.Man(self.board, side=side)
+                piece.x = x
+                piece.y = y
+                player.pieces.append( piece )
+                self.board.setPiece( piece )
 
-        #pc.Piece.board.printOut()
+        if ( colorToMove == self.p1.color ):
+            self.playerToMove = self.p1
+        else:
+            self.playerToMove = self.p2
 
     def stepGame( self ):
         """
         Perform one move
         """
-        self.numberOfTurns += 1
         piece, newmove, catchTree = self.playerToMove.movePolicy.getMove()
+        self.applyMove( piece, newmove, catchTree )
+
+    def applyMove( self, piece, newmove, catchTree ):
+        """
+        Perform the move returned by the move policy of the player to move,
+        and check if the game is finished
+        """
+        self.numberOfTurns += 1
         if ( self.playerToMove.movePolicy.state == "noAvailableMoves" ):
             if ( self.playerToMove == self.p1 ):
                 self.p2.winner = True
@@ -228,169 +312,321 @@ class Game:
 
     def undoMove( self ):
         """
-        Undo last move. Note that only one move is stored so succesive calls
-        to this function will not redo moves.
+        Undo the last move on the move stack. Successive calls undo
+        earlier moves
         """
-        newEmptyPiece = pc.Piece()
-        newEmptyPiece.x = self.pieceMoved.x
-        newEmptyPiece.y = self.pieceMoved.y
-        self.pieceMoved.x = self.movedFrom[0]
-        self.pieceMoved.y = self.movedFrom[1]
-        pc.Piece.board.setPiece( self.pieceMoved )
-        pc.Piece.board.setPiece( newEmptyPiece )
+        pieceMoved, fromX, fromY, piecesRemoved, promoted, opponent = self.moveStack.pop()
+        if ( promoted ):
+            pieceMoved.demote()
+        self.board.clearSquare( pieceMoved.x, pieceMoved.y )
+        pieceMoved.x = fromX
+        pieceMoved.y = fromY
+        self.board.setPiece( pieceMoved )
 
-        if ( self.playerToMove == self.p1 ):
-            playerLosingPiece = self.p2
-        else:
-            playerLosingPiece = self.p1
-
-        if ( not self.newKing is None ):
-            self.playerToMove.pieces.remove(self.newKing)
-            self.newKing = None
-            self.playerToMove.pieces.append(self.pieceMoved)
+        for piece in piecesRemoved:
+            opponent.pieces.append(piece)
+            self.board.setPiece(piece)
 
-        for piece in self.piecesRemoved:
-            playerLosingPiece.pieces.append(piece)
-            pc.Piece.board.setPiece(piece)
-
-        pc.Piece.board.checkConsistency( self.p1 )
-        pc.Piece.board.checkConsistency( self.p2 )
+        self.board.checkConsistency( self.p1 )
+        self.board.checkConsistency( self.p2 )
 
     def move( self, pieceToMove, newPosition, catchTree ):
         """
         Move a piece
         """
-        self.newKing = None
         if ( pieceToMove is None ):
             return
         valid, tree = pieceToMove.validMoves()
         if ( not newPosition in valid ):
             print (newPosition)
             print (pieceToMove.name, pieceToMove.color, pieceToMove.x, pieceToMove.y )
-            print (pc.Piece.board.getPiece(pieceToMove.x,pieceToMove.y))
-            pc.Piece.board.save("boardError.csv")
+            print (self.board.getPiece(pieceToMove.x,pieceToMove.y))
+            self.board.save("boardError.csv")
             print ("The suggested move is not valid!")
             exit()
             return
-        pieceCaptured = np.abs( newPosition[1] - pieceToMove.y ) > 1
-        self.movedFrom = [pieceToMove.x,pieceToMove.y]
-        self.pieceMoved = pieceToMove
-        self.piecesRemoved = []
+
+        mover = self.playerToMove
+        if ( mover == self.p1 ):
+            opponent = self.p2
+        else:
+            opponent = self.p1
+
+        # Regular moves are one step diagonally, while the landing square of a
+        # capture is an even number of columns away (possibly zero for kings)
+        pieceCaptured = np.abs( newPosition[0] - pieceToMove.x ) != 1
+        fromX = pieceToMove.x
+        fromY = pieceToMove.y
+        piecesRemoved = []
 
         if ( pieceCaptured ):
-            moves = catchTree.getPath( newPosition[0], newPosition[1] )
-            for i in range(0,len(moves)-1):
-                middleX = int( (moves[i][0]+moves[i+1][0])/2 )
-                middleY = int( (moves[i][1]+moves[i+1][1])/2 )
-                newEmptyPiece = pc.Piece()
-                newEmptyPiece.x = middleX
-                newEmptyPiece.y = middleY
-                pieceToRemove = pc.Piece.board.getPiece(middleX,middleY)
-                self.piecesRemoved.append(pieceToRemove)
-                if ( pieceToRemove.name == "empty" or pieceToRemove.color == pieceToMove.color ):
+            for middleX, middleY in catchTree.getCaptured( newPosition[0], newPosition[1] ):
+                pieceToRemove = self.board.getPiece(middleX,middleY)
+                piecesRemoved.append(pieceToRemove)
+                if ( pieceToRemove.kind == pc.EMPTY or pieceToRemove.side == pieceToMove.side ):
                     print ("==== ERROR INFORMATION ======")
-                    print (moves)
+                    print (catchTree.getPath( newPosition[0], newPosition[1] ))
                     print (pieceToRemove.x, pieceToRemove.y )
                     print (pieceToMove.x, pieceToMove.y )
                     print (pieceToMove.color, pieceToRemove.color )
                     print (pieceToMove.name, pieceToMove.name )
-                    pc.Piece.board.save( "boardError.csv" )
+                    self.board.save( "boardError.csv" )
                     print ("Abort! Error when removing piece")
                     exit()
                 try:
-                    if ( self.playerToMove == self.p1 ):
-                        self.p2.pieces.remove( pieceToRemove )
-                    else:
-                        self.p1.pieces.remove( pieceToRemove )
+                    opponent.pieces.remove( pieceToRemove )
                 except Exception as exc:
                     print (pieceToRemove.name, pieceToRemove.color, pieceToRemove.x, pieceToRemove.y )
                     print (pieceToMove.name, pieceToMove.color, pieceToMove.x, pieceToMove.y, newPosition )
-                    pc.Piece.board.save( "LastBoardBeforeError.csv" )
+                    self.board.save( "LastBoardBeforeError.csv" )
                     raise exc
-                pc.Piece.board.setPiece( newEmptyPiece )
+                self.board.clearSquare( middleX, middleY )
 
-        copy = pc.Piece.board.getPiece( newPosition[0], newPosition[1] )
-        copy.x = pieceToMove.x
-        copy.y = pieceToMove.y
+        self.board.clearSquare( fromX, fromY )
         pieceToMove.x = newPosition[0]
         pieceToMove.y = newPosition[1]
-        pc.Piece.board.setPiece( pieceToMove )
-        pc.Piece.board.setPiece( copy )
-        #pc.Piece.board.save("lastState.csv")
-
-        if ( pieceToMove.color == "white" and newPosition[1] == 7 and pieceToMove.name != "king" ):
-            self.playerToMove.pieces.remove(pieceToMove)
-            newKing = pc.King()
-            newKing.color = "white"
-            newKing.x = newPosition[0]
-            newKing.y = newPosition[1]
-            self.playerToMove.pieces.append(newKing)
-            self.newKing = newKing
-            pc.Piece.board.setPiece(newKing)
-        elif ( pieceToMove.color == "black" and newPosition[1] == 0 and pieceToMove.name != "king" ):
-            self.playerToMove.pieces.remove(pieceToMove)
-            newKing = pc.King()
-            newKing.color = "black"
-            newKing.x = newPosition[0]
-            newKing.y = newPosition[1]
-            self.playerToMove.pieces.append( newKing )
-            self.newKing = newKing
-            pc.Piece.board.setPiece(newKing)
+        self.board.setPiece( pieceToMove )
+        #self.board.save("lastState.csv")
+
+        promoted = pieceToMove.kind == pc.MAN and newPosition[1] == PROMOTION_ROW[pieceToMove.side]
+        if ( promoted ):
+            pieceToMove.promote()
+        self.moveStack.append( (pieceToMove, fromX, fromY, piecesRemoved, promoted, opponent) )
 
 class CleverMover(MovePolicy):
     """
     Move based on the neural network
     """
-    def __init__(self, pieces, network, game ):
+    def __init__(self, pieces, network, game, color ):
         super().__init__(pieces)
         self.network = network
         self.game = game
+        self.color = color
         self.selectedPiece = None
         self.newPosition = None
 
     def boardToInputState( self ):
         """
-        Translate the current board state to an input to the neural network
+        Translate the current board state to an input to the neural network.
+        The board keeps the input state up to date as pieces are moved
         """
-        inputState = np.zeros(5*64)-0.25
-        for i in range(0,8):
-            for j in range(0,8):
-                indx = i*8+j
-                piece = pc.Piece.board.getPiece(i,j)
-                if ( piece.name == "empty" ):
-                    inputState[indx] = 1.0
-                elif ( piece.name == "man" and piece in self.pieces ):
-                    inputState[indx+1] = 1.0
-                elif ( piece.name == "king" and piece in self.pieces ):
-                    inputState[indx+2] = 1.0
-                elif ( piece.name == "man" ):
-                    inputState[indx+3] = 1.0
-                elif ( piece.name == "king" ):
-                    inputState[indx+4] = 1.0
-                else:
-                    raise Exception( "Error when converting the board to input state for the neural network")
-        return inputState
+        return self.game.board.inputStates[self.color].copy()
+
+    def candidateInputStates( self, candidates ):
+        """
+        Return the input states of the positions reached by the candidate
+        moves, one row per candidate
+        """
+        inputStates = np.zeros( (len(candidates), len(self.game.board.inputStates[self.color])) )
+        for i in range(0,len(candidates)):
+            piece, move, catchTree = candidates[i]
+            self.game.move( piece, move, catchTree )
+            inputStates[i,:] = self.game.board.inputStates[self.color]
+            self.game.undoMove()
+        return inputStates
 
     def getMove( self ):
         """
-        Return the selected move
+        Return the selected move. All candidate positions are encoded first
+        and then scored with one call to the network
         """
-        value = -np.inf
-        selectedCatch = None
-        foundMove = False
-        for piece in self.pieces:
-            valid, catchTree = piece.validMoves()
-            for move in valid:
-                self.game.move( piece, move, catchTree )
-                inp = self.boardToInputState()
-                newvalue = self.network.evaluate(inp)
-                if ( newvalue > value ):
-                    newvalue = value
-                    self.selectedPiece = piece
-                    self.newPosition = move
-                    selectedCatch = catchTree
-                    foundMove = True
-                self.game.undoMove()
-        if ( not foundMove ):
+        candidates = legalMoves( self.pieces )
+        if ( len(candidates) == 0 ):
+            self.state = "noAvailableMoves"
+            return self.selectedPiece, self.newPosition, None
+
+        best = np.argmax( self.network.evaluateBatch( self.candidateInputStates(candidates) ) )
+        self.selectedPiece, self.newPosition, selectedCatch = candidates[best]
+        return self.selectedPiece, self.newPosition, selectedCatch
+
+class AlphaBetaMover(MovePolicy):
+    """
+    Negamax alpha-beta search with iterative deepening. The leaves are scored
+    by evaluator, which is either a neural network or a function
+    evaluator(game, color) returning the score seen from color. Positions
+    already searched are looked up in the optional transposition table
+    """
+    def __init__( self, pieces, evaluator, game, maxDepth=4, timeLimit=None, transpositionTable=None ):
+        super().__init__(pieces)
+        self.evaluator = evaluator
+        self.game = game
+        self.maxDepth = maxDepth
+        self.timeLimit = timeLimit
+        self.transpositionTable = transpositionTable
+        self.selectedPiece = None
+        self.newPosition = None
+
+        # Score of a lost position. Has to be larger than any evaluation
+        self.lossScore = 1E6
+
+        # Search statistics of the last call to getMove
+        self.nodesSearched = 0
+        self.depthReached = 0
+        self.searchTime = 0.0
+        self.nodesPerSecond = 0.0
+        self.aborted = False
+        self.endTime = None
+
+    def evaluatePosition( self, color ):
+        """
+        Score of the current position seen from the player with the given color
+        """
+        if ( hasattr(self.evaluator, "evaluate") ):
+            return self.evaluator.evaluate( self.game.board.inputStates[color] )
+        return self.evaluator( self.game, color )
+
+    def orderedMoves( self, player ):
+        """
+        Return all moves of the player as (piece, move, catchTree). Captures are
+        searched first as they most often lead to cut-offs
+        """
+        captures = []
+        regular = []
+        for candidate in legalMoves( player.pieces ):
+            piece, move, catchTree = candidate
+            if ( np.abs(move[0]-piece.x) != 1 ):
+                captures.append( candidate )
+            else:
+                regular.append( candidate )
+        return captures+regular
+
+    def opponentOf( self, player ):
+        if ( player == self.game.p1 ):
+            return self.game.p2
+        return self.game.p1
+
+    def negamax( self, player, depth, alpha, beta ):
+        """
+        Return the score of the current position seen from player, who is to move
+        """
+        self.nodesSearched += 1
+        if ( self.stopRequested or (not self.endTime is None and time.time() > self.endTime) ):
+            self.aborted = True
+            return 0.0
+
+        if ( len(player.pieces) == 0 ):
+            return -self.lossScore - depth
+        if ( depth == 0 ):
+            return self.evaluatePosition( player.color )
+
+        table = self.transpositionTable
+        tableMove = None
+        if ( not table is None ):
+            key = self.game.hashKey()
+            alphaOrig = alpha
+            entry = table.probe(key)
+            if ( not entry is None ):
+                score, storedDepth, flag, tableMove = entry
+                if ( storedDepth >= depth ):
+                    if ( flag == tt.EXACT ):
+                        return score
+                    elif ( flag == tt.LOWER_BOUND ):
+                        alpha = max( alpha, score )
+                    else:
+                        beta = min( beta, score )
+                    if ( alpha >= beta ):
+                        return score
+
+        moves = self.orderedMoves( player )
+        if ( len(moves) == 0 ):
+            # Losing later is better than losing now
+            return -self.lossScore - depth
+        if ( not tableMove is None ):
+            self.searchFirst( moves, table.decodeMove(tableMove) )
+
+        opponent = self.opponentOf(player)
+        best = -np.inf
+        bestMove = moves[0]
+        for candidate in moves:
+            piece, move, catchTree = candidate
+            value = -self.searchMove( player, opponent, piece, move, catchTree, depth, -beta, -alpha )
+            if ( self.aborted ):
+                return 0.0
+            if ( value > best ):
+                best = value
+                bestMove = candidate
+            if ( best > alpha ):
+                alpha = best
+            if ( alpha >= beta ):
+                break
+
+        if ( not table is None ):
+            flag = tt.EXACT
+            if ( best <= alphaOrig ):
+                flag = tt.UPPER_BOUND
+            elif ( best >= beta ):
+                flag = tt.LOWER_BOUND
+            piece, move, catchTree = bestMove
+            table.store( key, best, depth, flag, table.encodeMove(piece.x,piece.y,move[0],move[1]) )
+        return best
+
+    def searchFirst( self, moves, decodedMove ):
+        """
+        Move the move given as (fromX,fromY,toX,toY) to the front of moves
+        """
+        fromX, fromY, toX, toY = decodedMove
+        for i in range(0,len(moves)):
+            piece, move, catchTree = moves[i]
+            if ( piece.x == fromX and piece.y == fromY and move[0] == toX and move[1] == toY ):
+                moves.insert( 0, moves.pop(i) )
+                return
+
+    def searchMove( self, player, opponent, piece, move, catchTree, depth, alpha, beta ):
+        """
+        Perform the move, search the resulting position and undo the move
+        """
+        self.game.move( piece, move, catchTree )
+        self.game.playerToMove = opponent
+        value = self.negamax( opponent, depth-1, alpha, beta )
+        self.game.playerToMove = player
+        self.game.undoMove()
+        return value
+
+    def getMove( self ):
+        """
+        Return the best move found within the maximum depth and time limit
+        """
+        startTime = time.time()
+        self.endTime = None
+        if ( not self.timeLimit is None ):
+            self.endTime = startTime + self.timeLimit
+        self.nodesSearched = 0
+        self.depthReached = 0
+        self.aborted = False
+        self.stopRequested = False
+        if ( not self.transpositionTable is None ):
+            self.transpositionTable.newSearch()
+
+        player = self.game.playerToMove
+        opponent = self.opponentOf(player)
+        rootMoves = self.orderedMoves( player )
+        if ( len(rootMoves) == 0 ):
             self.state = "noAvailableMoves"
+            return self.selectedPiece, self.newPosition, None
+
+        bestMove = rootMoves[0]
+        for depth in range(1,self.maxDepth+1):
+            alpha = -np.inf
+            bestInIteration = None
+            for candidate in rootMoves:
+                piece, move, catchTree = candidate
+                value = -self.searchMove( player, opponent, piece, move, catchTree, depth, -np.inf, -alpha )
+                if ( self.aborted ):
+                    break
+                if ( bestInIteration is None or value > alpha ):
+                    alpha = value
+                    bestInIteration = candidate
+            if ( self.aborted ):
+                break
+            bestMove = bestInIteration
+            self.depthReached = depth
+
+            # Search the best move first in the next iteration
+            rootMoves.remove(bestMove)
+            rootMoves.insert(0,bestMove)
+
+        self.searchTime = time.time() - startTime
+        if ( self.searchTime > 0.0 ):
+            self.nodesPerSecond = self.nodesSearched/self.searchTime
+        self.selectedPiece, self.newPosition, selectedCatch = bestMove
         return self.selectedPiece, self.newPosition, selectedCatch
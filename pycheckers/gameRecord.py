@@ -0,0 +1,190 @@
+import game as gm
+import numpy as np
+import os
+
+# File layout (little endian):
+#   file header: MAGIC (8 bytes), format version (uint16)
+#   per game:    number of moves (uint16), result (uint8), reserved (uint8),
+#                one uint16 per move
+# A move is stored as 32*from+to where from and to are the indices (x+8y)/2
+# of the playable squares
+MAGIC = b"PYCHKREC"
+VERSION = 1
+FILE_HEADER_SIZE = len(MAGIC)+2
+GAME_HEADER_SIZE = 4
+
+RESULTS = ["p1","p2","draw"]
+
+def fileHeader():
+    return MAGIC + np.uint16(VERSION).astype("<u2").tobytes()
+
+def checkHeader( header, fname ):
+    """
+    Raise an exception unless header is the file header of this format and version
+    """
+    if ( bytes(header[:len(MAGIC)]) != MAGIC or len(header) < FILE_HEADER_SIZE ):
+        raise Exception("%s is not a game record file!"%(fname))
+    version = int( np.frombuffer( bytes(header[len(MAGIC):FILE_HEADER_SIZE]), dtype="<u2" )[0] )
+    if ( version != VERSION ):
+        raise Exception("Unsupported game record version %d in %s"%(version, fname))
+
+def encodeMove( fromX, fromY, toX, toY ):
+    return 32*((fromX+8*fromY)//2) + (toX+8*toY)//2
+
+def decodeMove( code ):
+    """
+    Return (fromX, fromY, toX, toY) of an encoded move
+    """
+    frm, to = divmod( int(code), 32 )
+    fromY = frm//4
+    toY = to//4
+    return 2*(frm%4)+fromY%2, fromY, 2*(to%4)+toY%2, toY
+
+def encodeGame( game ):
+    """
+    Return the moves played in game as an array of encoded moves. The move
+    stack only holds the start square of each move, the destination is where
+    the same piece starts its next move, or where it is now
+    """
+    moves = np.zeros( len(game.moveStack), dtype=np.uint16 )
+    nextStart = {}
+    for i in range(len(game.moveStack)-1,-1,-1):
+        piece, fromX, fromY = game.moveStack[i][:3]
+        toX, toY = nextStart.get( piece, (piece.x,piece.y) )
+        moves[i] = encodeMove( fromX, fromY, toX, toY )
+        nextStart[piece] = (fromX,fromY)
+    return moves
+
+def replay( moves, game=None ):
+    """
+    Play the encoded moves from the start position (or from the position of
+    game) and yield the game after every move
+    """
+    if ( game is None ):
+        game = gm.Game()
+        game.setupGame()
+    for code in moves:
+        fromX, fromY, toX, toY = decodeMove( code )
+        piece = game.board.getPiece( fromX, fromY )
+        valid, catchTree = piece.validMoves()
+        game.move( piece, [toX,toY], catchTree )
+        game.numberOfTurns += 1
+        if ( game.playerToMove == game.p1 ):
+            game.playerToMove = game.p2
+        else:
+            game.playerToMove = game.p1
+        yield game
+
+class GameRecordWriter:
+    """
+    Appends games to a record file. The file is created if it does not exist,
+    and an existing file must have the header of this format and version. A
+    partly written last game, left by a crash, is removed before appending.
+    The file is flushed after every game
+    """
+    def __init__( self, fname ):
+        self.fname = fname
+        newFile = not os.path.exists(fname) or os.path.getsize(fname) == 0
+        if ( not newFile ):
+            reader = GameRecordReader( fname )
+            reader.buildIndex()
+            completeSize = reader.completeSize
+            del reader
+            if ( completeSize < os.path.getsize(fname) ):
+                print ("Removing an incomplete game at the end of %s"%(fname))
+                os.truncate( fname, completeSize )
+        self.out = open(fname, 'ab')
+        if ( newFile ):
+            self.out.write( fileHeader() )
+        self.numberOfGames = 0
+
+    def write( self, moves, result ):
+        """
+        Append one game. moves is an array of encoded moves and result one
+        of "p1", "p2" or "draw"
+        """
+        if ( len(moves) > 65535 ):
+            raise Exception("Games with more than 65535 moves can not be stored!")
+        self.out.write( np.array([len(moves)], dtype="<u2").tobytes() + bytes([RESULTS.index(result),0]) )
+        self.out.write( np.asarray(moves, dtype="<u2").tobytes() )
+        self.out.flush()
+        self.numberOfGames += 1
+
+    def flush( self ):
+        self.out.flush()
+
+    def close( self ):
+        self.out.close()
+
+class GameRecordReader:
+    """
+    Iterates over the games in a record file. The file is memory mapped, so
+    only the games that are read are loaded from disk. An empty file, which
+    is left when the writer stops before its first flush, holds no games. A
+    last game that was only partly written is skipped
+    """
+    def __init__( self, fname ):
+        self.fname = fname
+        if ( os.path.getsize(fname) == 0 ):
+            # Empty files can not be memory mapped
+            self.data = np.frombuffer( fileHeader(), dtype=np.uint8 )
+        else:
+            self.data = np.memmap( fname, dtype=np.uint8, mode='r' )
+        checkHeader( self.data[:FILE_HEADER_SIZE], fname )
+        self.offsets = None
+
+        # Size of the file up to the end of the last complete game, known
+        # after buildIndex
+        self.completeSize = None
+
+    def gameEnd( self, offset ):
+        """
+        Return the offset after the game stored at offset, or None if the
+        game is not completely written
+        """
+        if ( offset+GAME_HEADER_SIZE > len(self.data) ):
+            return None
+        end = offset + GAME_HEADER_SIZE + 2*( int(self.data[offset]) + 256*int(self.data[offset+1]) )
+        if ( end > len(self.data) ):
+            return None
+        return end
+
+    def readGame( self, offset ):
+        """
+        Return the result, the encoded moves and the offset of the next game
+        for the game stored at offset
+        """
+        end = self.gameEnd( offset )
+        if ( end is None ):
+            raise Exception("The game at offset %d in %s is incomplete!"%(offset, self.fname))
+        result = RESULTS[self.data[offset+2]]
+        return result, self.data[offset+GAME_HEADER_SIZE:end].view("<u2"), end
+
+    def __iter__( self ):
+        offset = FILE_HEADER_SIZE
+        while ( not self.gameEnd(offset) is None ):
+            result, moves, offset = self.readGame( offset )
+            yield result, moves
+
+    def buildIndex( self ):
+        """
+        Find the offset of every complete game, which allows random access
+        """
+        offsets = []
+        offset = FILE_HEADER_SIZE
+        while ( not self.gameEnd(offset) is None ):
+            offsets.append( offset )
+            offset = self.gameEnd( offset )
+        self.offsets = np.array( offsets, dtype=np.int64 )
+        self.completeSize = offset
+
+    def __len__( self ):
+        if ( self.offsets is None ):
+            self.buildIndex()
+        return len(self.offsets)
+
+    def __getitem__( self, indx ):
+        if ( self.offsets is None ):
+            self.buildIndex()
+        result, moves, end = self.readGame( int(self.offsets[indx]) )
+        return result, moves
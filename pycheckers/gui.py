@@ -1,6 +1,57 @@
 import game as gm
 import piece as pc
 import pygame as pg
+import threading
+import time
+
+# Posted by a MoveWorker when its move is ready
+MOVE_READY = pg.USEREVENT
+
+class MoveWorker:
+    """
+    Computes the move of a move policy in a background thread, such that the
+    GUI stays responsive while the engine is thinking. The game must not be
+    read or changed by other threads until the worker is done, since the
+    policies search by playing moves on the game
+    """
+    def __init__( self, policy, timeBudget=None ):
+        self.policy = policy
+        self.timeBudget = timeBudget
+        self.startTime = time.time()
+        self.result = None
+        self.error = None
+        self.done = False
+        self.thread = threading.Thread( target=self.run, daemon=True )
+        self.thread.start()
+
+    def run( self ):
+        try:
+            self.result = self.policy.getMove()
+        except Exception as exc:
+            self.error = exc
+        self.done = True
+        try:
+            pg.event.post( pg.event.Event(MOVE_READY) )
+        except pg.error:
+            # The display was closed while the move was computed
+            pass
+
+    def isDone( self ):
+        return self.done
+
+    def checkTimeBudget( self ):
+        """
+        Ask the policy to return its best move if the time budget is used
+        """
+        if ( not self.timeBudget is None and time.time()-self.startTime > self.timeBudget ):
+            self.policy.requestStop()
+
+    def cancel( self, timeout=1.0 ):
+        """
+        Stop the computation and discard the move
+        """
+        self.policy.requestStop()
+        self.thread.join( timeout )
 
 class PyCheckerGUI:
     def __init__( self ):
@@ -13,66 +64,99 @@ class PyCheckerGUI:
         self.height = 500
         self.saveLastState = False
 
+        # Maximum number of seconds an engine may think about a move. Set to
+        # None to let the engine use its own limits
+        self.moveTimeBudget = 5.0
+        self.worker = None
+        self.drawnThinking = None
+
         # Initialize pygame
         pg.init()
         self.screen = pg.display.set_mode((self.width,self.height))
         pg.display.set_caption("PyCheckers")
         self.pgclock = pg.time.Clock()
-        self.highlightedTiles = []
+        self.highlightedTiles = set()
+
+        # Fonts and the images of the pieces are created once
+        self.moveFont = pg.font.SysFont('Comic Sans MS', 60)
+        self.resultFont = pg.font.SysFont('Comic Sans MS', 30)
+        self.pieceSurfaces = {}
+        for kind in [pc.MAN, pc.KING]:
+            for side in [pc.WHITE, pc.BLACK]:
+                self.pieceSurfaces[(kind,side)] = self.createPieceSurface( kind, side )
+
+        # What is currently shown on each square and as move number. Only the
+        # parts of the screen that differ from the game state are redrawn
+        self.drawnSquares = {}
+        self.drawnMoveNumber = None
+        self.drawnResult = False
+        self.dirtyRects = []
+
+        # True when the board, the move number or the result was redrawn
+        # after the last snapshot was saved
+        self.snapshotOutdated = False
 
     def getTileSize( self ):
         return self.height/8
 
-    def drawTile( self, x, y, highlight=False ):
-        tilewidth = self.getTileSize()
-        tileheight = self.getTileSize()
-        pixelX = tilewidth*x
-        pixelY = tileheight*y
+    def getTileRect( self, x, y ):
+        tileSize = self.getTileSize()
+        left = int(tileSize*x)
+        top = int(tileSize*y)
+        return pg.Rect( left, top, int(tileSize*(x+1))-left, int(tileSize*(y+1))-top )
 
-        if ( highlight ):
-            pg.draw.rect( self.screen, self.highlightColor, (pixelX,pixelY,tilewidth,tileheight), 0 )
-            return
+    def createPieceSurface( self, kind, side ):
+        """
+        Draw a piece of the given kind and side on a transparent surface of the
+        size of a tile
+        """
+        tileSize = self.getTileSize()
+        surface = pg.Surface( (int(tileSize)+1,int(tileSize)+1), pg.SRCALPHA )
+        piece = pc.Piece( None, kind=kind, side=side )
+        piece.draw( surface, tileSize, tileSize )
+        return surface
 
-        if ( y%2 == 0 ):
-            # Even row
-            if ( x%2 == 0 ):
-                color = self.darkField
-            else:
-                color = self.brightField
+    def drawTile( self, x, y, highlight=False ):
+        rect = self.getTileRect( x, y )
+        if ( highlight ):
+            self.screen.fill( self.highlightColor, rect )
+        elif ( (x+y)%2 == 0 ):
+            self.screen.fill( self.darkField, rect )
         else:
-            if ( x%2 == 0 ):
-                color = self.brightField
-            else:
-                color = self.darkField
-
-        pg.draw.rect( self.screen, color, (pixelX,pixelY,tilewidth,tileheight), 0 )
-
+            self.screen.fill( self.brightField, rect )
+        return rect
 
     def initBoard( self ):
-        for i in range(0,8):
-            for j in range(0,8):
-                self.drawTile(i,j)
-
-        # Draw all the pieces
-        self.drawPieces()
-        pg.display.update()
+        """
+        Draw everything on the next update
+        """
+        self.screen.fill( (0,0,0) )
+        self.drawnSquares = {}
+        self.drawnMoveNumber = None
+        self.drawnResult = False
+        self.drawnThinking = None
+        self.dirtyRects = [self.screen.get_rect()]
 
     def drawBoard( self ):
-        for i in range(0,8):
-            for j in range(0,8):
-                if ( [i,j] in self.highlightedTiles ):
-                    self.drawTile(i,j,highlight=True)
-                else:
-                    self.drawTile(i,j)
-
-    def drawPieces( self ):
-        for piece in self.game.p1.pieces:
-            piece.draw( self.screen, self.getTileSize(), self.getTileSize() )
-        for piece in self.game.p2.pieces:
-            piece.draw( self.screen, self.getTileSize(), self.getTileSize() )
+        """
+        Redraw the squares whose piece or highlighting changed since they were
+        last drawn
+        """
+        for x in range(0,8):
+            for y in range(0,8):
+                piece = self.game.board.getPiece(x,y)
+                content = (piece.kind, piece.side, (x,y) in self.highlightedTiles)
+                if ( self.drawnSquares.get((x,y)) == content ):
+                    continue
+                self.drawnSquares[(x,y)] = content
+                rect = self.drawTile( x, y, highlight=content[2] )
+                if ( piece.kind != pc.EMPTY ):
+                    self.screen.blit( self.pieceSurfaces[(piece.kind,piece.side)], rect.topleft )
+                self.dirtyRects.append( rect )
+                self.snapshotOutdated = True
 
     def mouseClickHander( self ):
-        if ( self.game.state == "finished" ):
+        if ( self.game.state == "finished" or self.isThinking() ):
             return
         pos = pg.mouse.get_pos()
 
@@ -84,11 +168,11 @@ class PyCheckerGUI:
 
             for piece in self.game.playerToMove.pieces:
                 if ( x==piece.x and y==piece.y ):
-                    self.highlightedTiles = []
-                    self.highlightedTiles.append([x,y])
+                    self.highlightedTiles = set()
+                    self.highlightedTiles.add( (x,y) )
                     self.game.playerToMove.movePolicy.selectPiece(x,y)
                     validMoves, catchTree = piece.validMoves()
-                    self.highlightedTiles += validMoves
+                    self.highlightedTiles.update( (move[0],move[1]) for move in validMoves )
                     break
 
             self.game.playerToMove.movePolicy.selecteNewPosition(x,y)
@@ -97,32 +181,103 @@ class PyCheckerGUI:
                 self.game.stepGame()
 
     def returnKeyHandler( self ):
+        if ( self.isThinking() ):
+            return
         if ( isinstance(self.game.playerToMove.movePolicy, gm.HumanUser) ):
             return
         if ( self.game.state == "finished" ):
             return
-        self.game.stepGame()
+        self.startEngineMove()
+
+    def isThinking( self ):
+        return not self.worker is None
+
+    def startEngineMove( self ):
+        """
+        Let the policy of the player to move compute its move in the background
+        """
+        self.worker = MoveWorker( self.game.playerToMove.movePolicy, timeBudget=self.moveTimeBudget )
+
+    def finishEngineMove( self ):
+        """
+        Apply the move of the worker if it is done
+        """
+        if ( not self.isThinking() ):
+            return
+        if ( not self.worker.isDone() ):
+            self.worker.checkTimeBudget()
+            return
+        worker = self.worker
+        self.worker = None
+        if ( not worker.error is None ):
+            raise worker.error
+        self.game.applyMove( *worker.result )
+
+    def updateThinking( self ):
+        """
+        Show an animated indicator while the engine is thinking. Fast moves
+        are applied before the indicator appears, which avoids flickering
+        """
+        dots = None
+        elapsed = 0.0
+        if ( self.isThinking() ):
+            elapsed = time.time()-self.worker.startTime
+        if ( elapsed > 0.25 ):
+            dots = int( 2.0*elapsed )%4
+        if ( self.drawnThinking == dots ):
+            return
+        self.drawnThinking = dots
+        posX = 8*self.getTileSize()+10
+        posY = 2*self.getTileSize()
+        rect = pg.Rect( posX, posY, 200, 40 )
+        self.screen.fill( (0,0,0), rect )
+        if ( not dots is None ):
+            textsurface = self.resultFont.render("Thinking"+"."*dots, False, (77,175,74))
+            self.screen.blit(textsurface,(posX, posY))
+        self.dirtyRects.append( rect )
 
     def gameFinished( self ):
+        if ( self.drawnResult ):
+            return
+        self.drawnResult = True
         text = "It's a draw!"
         if ( self.game.p1.winner ):
             text = "Player: %s won"%(self.game.p1.name)
         elif( self.game.p2.winner ):
             text = "Player: %s won"%(self.game.p2.name)
-        font = pg.font.SysFont('Comic Sans MS', 30)
-        textsurface = font.render(text, False, (0, 0, 0))
-        self.screen.blit(textsurface,(0,0))
+        textsurface = self.resultFont.render(text, False, (0, 0, 0))
+        self.dirtyRects.append( self.screen.blit(textsurface,(0,0)) )
+        self.snapshotOutdated = True
 
     def updateMoveNumber( self ):
+        if ( self.drawnMoveNumber == self.game.numberOfTurns ):
+            return
+        self.drawnMoveNumber = self.game.numberOfTurns
         posX = 8*self.getTileSize()+10
         posY = self.getTileSize()
         height = 80
         width = 200
-        pg.draw.rect( self.screen, (0,0,0), (posX, posY, width, height) )
-        font = pg.font.SysFont('Comic Sans MS', 60)
+        rect = pg.Rect( posX, posY, width, height )
+        self.screen.fill( (0,0,0), rect )
         text = "Move: %d"%(self.game.numberOfTurns)
-        textsurface = font.render(text, False, (77,175,74))
+        textsurface = self.moveFont.render(text, False, (77,175,74))
         self.screen.blit(textsurface,(posX, posY))
+        self.dirtyRects.append( rect )
+        self.snapshotOutdated = True
+
+    def updateDisplay( self ):
+        """
+        Show the parts of the screen that were redrawn. A snapshot is only
+        saved when the board, the move number or the result changed, not when
+        only the thinking indicator is animated
+        """
+        if ( len(self.dirtyRects) == 0 ):
+            return
+        pg.display.update( self.dirtyRects )
+        self.dirtyRects = []
+        if ( self.saveLastState and self.snapshotOutdated ):
+            pg.image.save( self.screen, "lastState.jpg")
+        self.snapshotOutdated = False
 
     def hasHumanUser( self ):
         return isinstance( self.game.p1.movePolicy, gm.HumanUser ) or isinstance( self.game.p2.movePolicy, gm.HumanUser )
@@ -132,7 +287,17 @@ class PyCheckerGUI:
             done = False
             self.initBoard()
             while ( not done ):
-                for event in pg.event.get():
+                # While the engine is thinking, wake up regularly to animate the
+                # indicator. When only humans can change the state, sleep until
+                # an event arrives
+                if ( self.isThinking() ):
+                    events = [pg.event.wait(250)] + pg.event.get()
+                elif ( self.hasHumanUser() or self.game.state == "finished" ):
+                    events = [pg.event.wait()] + pg.event.get()
+                else:
+                    events = pg.event.get()
+
+                for event in events:
                     if ( event.type == pg.QUIT ):
                         done = True
                     elif ( event.type == pg.MOUSEBUTTONDOWN ):
@@ -140,22 +305,32 @@ class PyCheckerGUI:
                     elif ( event.type == pg.KEYDOWN):
                         if ( event.key==pg.K_RETURN):
                             self.returnKeyHandler()
+                    elif ( event.type == pg.VIDEOEXPOSE ):
+                        # The screen surface still holds the last drawn state
+                        self.dirtyRects.append( self.screen.get_rect() )
+                if ( done ):
+                    break
 
-                if ( not self.hasHumanUser() ):
-                    self.game.stepGame()
+                # The engine plays moves on the game while it searches, so the
+                # board is only drawn when no move is computed
+                self.finishEngineMove()
+                if ( not self.isThinking() ):
+                    self.drawBoard()
+                    self.updateMoveNumber()
                     if ( self.game.state == "finished" ):
-                        done = True
-                self.drawBoard()
-                self.drawPieces()
-                self.updateMoveNumber()
-                if ( self.game.state == "finished" ):
-                    self.gameFinished()
-                pg.display.update()
-                pg.display.flip()
-                self.pgclock.tick(10)
-                if ( self.saveLastState ):
-                    pg.image.save( self.screen, "lastState.jpg")
+                        self.gameFinished()
+                        if ( not self.hasHumanUser() ):
+                            done = True
+                    elif ( not self.hasHumanUser() ):
+                        self.startEngineMove()
+                self.updateThinking()
+                self.updateDisplay()
+                if ( not self.hasHumanUser() ):
+                    self.pgclock.tick(10)
         except Exception as exc:
             print (str(exc))
 
+        if ( self.isThinking() ):
+            self.worker.cancel()
+            self.worker = None
         pg.quit()
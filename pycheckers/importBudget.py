@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+
+# Modules imported by headless worker processes. Each must be importable
+# without the GUI libraries and within the budget, measured in a fresh
+# interpreter
+HEADLESS_MODULES = ["piece","game","bitboard","neuralNetwork","transpositionTable","selfPlay",
+                    "profiler","gameRecord","positionDataset","batchSimulator","perft","trainNetwork"]
+GUI_MODULES = ["pygame","matplotlib"]
+BUDGET_IN_SEC = 0.3
+
+def measureImport( module ):
+    """
+    Import module in a new interpreter. Returns the time it took and the GUI
+    modules that were loaded
+    """
+    code = "import sys, time\n" \
+           "start = time.perf_counter()\n" \
+           "import %s\n" \
+           "print(time.perf_counter()-start)\n" \
+           "print(' '.join(m for m in %s if m in sys.modules))\n"%(module, str(GUI_MODULES))
+    directory = os.path.dirname( os.path.abspath(__file__) )
+    output = subprocess.run( [sys.executable, "-c", code], cwd=directory, capture_output=True, text=True, check=True ).stdout.split("\n")
+    return float(output[0]), output[1].split()
+
+def main( argv ):
+    budget = BUDGET_IN_SEC
+    if ( len(argv) == 1 ):
+        budget = float(argv[0])
+
+    failures = 0
+    for module in HEADLESS_MODULES:
+        seconds, guiModules = measureImport( module )
+        status = "OK"
+        if ( len(guiModules) > 0 ):
+            status = "imports %s"%(", ".join(guiModules))
+            failures += 1
+        elif ( seconds > budget ):
+            status = "over budget"
+            failures += 1
+        print ("%-20s %6.3f s %s"%(module, seconds, status))
+
+    if ( failures > 0 ):
+        print ("%d modules are not headless or exceed the budget of %.2f s"%(failures, budget))
+        return 1
+    print ("All modules are headless and import within %.2f s"%(budget))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main( sys.argv[1:] ) )
@@ -1,41 +1,41 @@
 import numpy as np
 import pickle as pck
-from matplotlib import pyplot as plt
+import json
+import os
 
-class Neuron:
-    def __init__( self, nWeights ):
-        self.weights = np.ones(nWeights)
-        self.threshold = 1.0
+# Version of the layout written by Network.saveCheckpoint. Version 1 stored
+# the population with one chromosome per column
+CHECKPOINT_VERSION = 2
 
-    def evaluate( self, inputState ):
+class Layer:
+    def __init__( self, nIn, nOut ):
+        self.nIn = int(nIn)
+        self.nOut = int(nOut)
+        self.weights = np.ones((self.nOut,self.nIn))
+        self.thresholds = np.ones(self.nOut)
+
+    def getNumberOfParameters( self ):
         """
-        Evaluates the parameter z that is sent to the sigmoid function sigma(z) = 1/(1+exp(-z))
+        Number of weights and thresholds in the layer
         """
-        return (np.sum( self.weights*inputState ) - self.threshold)
+        return self.nOut*(self.nIn+1)
 
-class OutputNeuron:
-    def __init__(self):
-        pass
-    def evaluate( self, inputState ):
-        return inputState.mean()
-
-class Layer:
-    def __init__( self, nIn, nOut, useOutputNeurons=False ):
-        self.neurons = []
-        if ( useOutputNeurons ):
-            self.neurons.append(OutputNeuron())
-        else:
-            for i in range(0,int(nOut)):
-                self.neurons.append( Neuron(int(nIn)) )
+    def useParameterBuffer( self, buffer ):
+        """
+        Copy the weights and thresholds into buffer and make them views into it
+        """
+        nWeights = self.nOut*self.nIn
+        buffer[:nWeights] = self.weights.ravel()
+        buffer[nWeights:] = self.thresholds
+        self.weights = buffer[:nWeights].reshape((self.nOut,self.nIn))
+        self.thresholds = buffer[nWeights:]
 
     def evaluate( self, inputState ):
         """
-        Evaluates the output vector of the current layer
+        Evaluates the output vector of the current layer. If inputState is a
+        matrix, each row is treated as a separate input vector
         """
-        output = np.zeros(len(self.neurons) )
-        for i in range(0,len(self.neurons) ):
-            output[i] = self.sigmoid( self.neurons[i].evaluate(inputState) )
-        return output
+        return self.sigmoid( inputState.dot(self.weights.T) - self.thresholds )
 
     def sigmoid( self, z ):
         """
@@ -47,24 +47,41 @@ class Layer:
         """
         Plot subfigure corresponding to the current layer
         """
-        values = np.zeros((len(self.neurons),len(self.neurons[0].weights)))
-        for i in range(0,len(self.neurons)):
-            values[i,:] = self.neurons[i].weights
-        return ax.imshow( values, aspect="auto", cmap="inferno")
+        return ax.imshow( self.weights, aspect="auto", cmap="inferno")
 
 
 class Network:
-    def __init__( self, numberOfNeurons ):
+    def __init__( self, numberOfNeurons, seed=None, populationFile=None, populationType=np.float32 ):
         self.layers = []
         for i in range(0,len(numberOfNeurons)-1):
-            if ( numberOfNeurons[i] == 1 ):
-                self.layers.append( Layer( int(numberOfNeurons[i]), int(numberOfNeurons[i+1]) ), useOutputNeurons=True )
-            else:
-                self.layers.append( Layer( int(numberOfNeurons[i]), int(numberOfNeurons[i+1]) ) )
+            self.layers.append( Layer( int(numberOfNeurons[i]), int(numberOfNeurons[i+1]) ) )
+        self.useParameterBuffer()
         self.generateNewInitialCondition = True
-        self.ga = GeneticAlgorithm( self, 1000 )
+        self.ga = GeneticAlgorithm( self, 1000, seed=seed, populationFile=populationFile, dtype=populationType )
         self.numberOfGAGenerations = 100
 
+        # Progress of a partly evaluated generation, restored from a checkpoint
+        self.evaluationState = None
+
+    def __setstate__( self, state ):
+        # Pickle stores the layer views as separate arrays
+        self.__dict__.update(state)
+        self.useParameterBuffer()
+        if ( not "evaluationState" in state ):
+            self.evaluationState = None
+
+    def useParameterBuffer( self ):
+        """
+        Store the weights and thresholds of all layers, except the output layer,
+        in one contiguous vector
+        """
+        self.parameters = np.zeros( self.getNumberOfParameters() )
+        current = 0
+        for i in range(0,len(self.layers)-1):
+            layer = self.layers[i]
+            layer.useParameterBuffer( self.parameters[current:current+layer.getNumberOfParameters()] )
+            current += layer.getNumberOfParameters()
+
     def perturbNext( self, fitness ):
         """
         Use the next chromosome in the GA population
@@ -79,8 +96,7 @@ class Network:
         Set random thresholds
         """
         for layer in self.layers:
-            for neuron in layer.neurons:
-                neuron.threshold = np.random.normal(loc=0.0,scale=10.0)
+            layer.thresholds[:] = np.random.normal(loc=0.0,scale=10.0,size=layer.nOut)
 
     def getNumberOfParameters( self ):
         """
@@ -88,9 +104,7 @@ class Network:
         """
         nParams = 0
         for i in range(0,len(self.layers)-1):
-            layer = self.layers[i]
-            for neuron in layer.neurons:
-                nParams += (len(neuron.weights)+1)
+            nParams += self.layers[i].getNumberOfParameters()
         return nParams
 
     def evaluate( self, inputState ):
@@ -102,6 +116,16 @@ class Network:
             output = self.layers[i].evaluate(output)
         return output[0]
 
+    def evaluateBatch( self, inputStates ):
+        """
+        Evaluates the network for each row in inputStates. Returns a vector
+        with one value per row
+        """
+        output = inputStates
+        for layer in self.layers:
+            output = layer.evaluate(output)
+        return output[:,0]
+
     def save( self, fname ):
         """
         Dumps the current network to a pickle file
@@ -110,37 +134,65 @@ class Network:
         pck.dump( self, out )
         out.close()
 
+    def saveCheckpoint( self, fname, dtype=None, evaluationState=None ):
+        """
+        Write the network and the state of the GA to a .npz file. The
+        population is stored with its own precision unless dtype is given.
+        evaluationState is an optional dictionary of arrays describing a partly
+        evaluated generation, which is given back as network.evaluationState
+        by loadCheckpoint. The file is written under a temporary name and
+        renamed, so a crash never destroys the previous checkpoint
+        """
+        ga = self.ga
+        if ( dtype is None ):
+            dtype = ga.population.dtype
+        arrays = {
+            "version":np.array(CHECKPOINT_VERSION),
+            "numberOfNeurons":np.array( [layer.nIn for layer in self.layers]+[self.layers[-1].nOut] ),
+            "parameters":self.parameters,
+            "outputWeights":self.layers[-1].weights,
+            "outputThresholds":self.layers[-1].thresholds,
+            "generateNewInitialCondition":np.array(self.generateNewInitialCondition),
+            "numberOfGAGenerations":np.array(self.numberOfGAGenerations),
+            "population":ga.population.astype(dtype, copy=False),
+            "fitness":ga.fitness,
+            "gaCounters":np.array( [ga.currentChromosome, ga.currentGeneration, ga.numberOfParents] ),
+            "mutationProbability":np.array(ga.mutationProbability),
+            "rngState":np.array( json.dumps(ga.rng.bit_generator.state) )
+        }
+        if ( not evaluationState is None ):
+            for name, values in evaluationState.items():
+                arrays["evaluation_"+name] = values
+        tmpName = fname+".tmp"
+        out = open(tmpName, 'wb')
+        np.savez( out, **arrays )
+
+        # The data must be on disk before the rename, otherwise a power loss
+        # can leave an empty checkpoint under the final name
+        out.flush()
+        os.fsync( out.fileno() )
+        out.close()
+        os.replace( tmpName, fname )
+
     def collectParameters( self ):
         """
-        Collects all weights and threshold in a single vector
+        Returns the vector holding all weights and thresholds
         """
-        params = np.zeros( self.getNumberOfParameters() )
-        current = 0
-        for i in range(0,len(self.layers)-1):
-            layer = self.layers[i]
-            for neuron in layer.neurons:
-                params[current:current+len(neuron.weights)] = neuron.weights
-                params[current+len(neuron.weights)] = neuron.threshold
-                current += len(neuron.weights)+1
-        return params
+        return self.parameters
 
     def distribute( self, newvalues ):
         """
         Distributes the values in the vector newvalues to the weights and threshold in the neural network
         """
-        current = 0
-        assert( len(newvalues) == self.getNumberOfParameters() )
-        for i in range(0,len(self.layers)-1):
-            layer = self.layers[i]
-            for neuron in layer.neurons:
-                neuron.weights = newvalues[current:current+len(neuron.weights)]
-                neuron.threshold = newvalues[current+len(neuron.weights)]
-                current += len(neuron.weights)+1
+        assert( len(newvalues) == len(self.parameters) )
+        self.parameters[:] = newvalues
 
     def visualize( self ):
         """
         Create figure showing all the weights. Each subfigure corresponds to one layer
         """
+        # matplotlib is only needed for plotting
+        from matplotlib import pyplot as plt
         nLayers = len(self.layers)
         ncols = int(np.sqrt(nLayers))+1
         fig = plt.figure()
@@ -149,11 +201,79 @@ class Network:
             im = self.layers[i].visualize(ax)
             fig.colorbar(im)
 
+def loadCheckpoint( fname, populationFile=None ):
+    """
+    Return the network stored by Network.saveCheckpoint, with its GA. The
+    population keeps the precision it was stored with, and is memory mapped
+    to populationFile if given
+    """
+    data = np.load( fname )
+    version = int(data["version"])
+    if ( version > CHECKPOINT_VERSION ):
+        raise Exception("Unsupported checkpoint version %d in %s"%(version, fname))
+
+    # The population is restored from the file, so the constructors that
+    # create random initial states are bypassed
+    numberOfNeurons = data["numberOfNeurons"]
+    network = Network.__new__(Network)
+    network.layers = [Layer( numberOfNeurons[i], numberOfNeurons[i+1] ) for i in range(0,len(numberOfNeurons)-1)]
+    network.useParameterBuffer()
+    network.parameters[:] = data["parameters"]
+    network.layers[-1].weights[:,:] = data["outputWeights"]
+    network.layers[-1].thresholds[:] = data["outputThresholds"]
+    network.generateNewInitialCondition = bool(data["generateNewInitialCondition"])
+    network.numberOfGAGenerations = int(data["numberOfGAGenerations"])
+    network.evaluationState = None
+    evaluationKeys = [key for key in data.files if key.startswith("evaluation_")]
+    if ( len(evaluationKeys) > 0 ):
+        network.evaluationState = {key[len("evaluation_"):]:data[key] for key in evaluationKeys}
+
+    population = data["population"]
+    if ( version == 1 ):
+        population = population.T
+    ga = GeneticAlgorithm.__new__(GeneticAlgorithm)
+    ga.network = network
+    ga.populationSize = population.shape[0]
+    ga.blockSize = 64
+    ga.allocatePopulation( populationFile, population.dtype )
+    ga.population[:,:] = population
+    ga.fitness = data["fitness"].copy()
+    ga.currentChromosome, ga.currentGeneration, ga.numberOfParents = [int(value) for value in data["gaCounters"]]
+    ga.mutationProbability = float(data["mutationProbability"])
+    state = json.loads( str(data["rngState"]) )
+    ga.rng = np.random.Generator( getattr(np.random, state["bit_generator"])() )
+    ga.rng.bit_generator.state = state
+    network.ga = ga
+    data.close()
+    return network
+
+def loadNetwork( fname, populationFile=None ):
+    """
+    Load a network from a checkpoint (.npz) or from a pickle file written by
+    Network.save
+    """
+    if ( fname.endswith(".npz") ):
+        return loadCheckpoint( fname, populationFile=populationFile )
+    infile = open(fname, 'rb')
+    network = pck.load( infile )
+    infile.close()
+    return network
+
 class GeneticAlgorithm:
-    def __init__( self, network, populationSize ):
+    """
+    The population is stored with one chromosome per row in two buffers of
+    reduced precision. A new generation is written block by block into the
+    inactive buffer, which then becomes the active one. If populationFile is
+    given, the buffers are memory mapped to that file
+    """
+    def __init__( self, network, populationSize, seed=None, populationFile=None, dtype=np.float32 ):
         self.network = network
         self.populationSize = populationSize
-        self.population = np.zeros((self.network.getNumberOfParameters(),populationSize) )
+        self.rng = np.random.default_rng(seed)
+
+        # Number of chromosomes processed at a time when a generation is created
+        self.blockSize = 64
+        self.allocatePopulation( populationFile, dtype )
         self.generateNewInitialState()
         self.fitness = np.zeros(populationSize)
         self.currentChromosome = 0
@@ -161,6 +281,44 @@ class GeneticAlgorithm:
         self.mutationProbability = 0.05
         self.currentGeneration = 0
 
+    def __setstate__( self, state ):
+        self.__dict__.update(state)
+        if ( not "buffers" in state ):
+            # Pickled before the population was stored with one chromosome per
+            # row. The network may not be restored yet, so the size of the
+            # buffers is taken from the stored population of shape
+            # (numberOfParameters, populationSize)
+            population = self.population
+            self.blockSize = 64
+            self.allocatePopulation( numberOfParameters=population.shape[0] )
+            self.population[:,:] = population.T
+        if ( not "rng" in state ):
+            self.rng = np.random.default_rng()
+
+    def allocatePopulation( self, populationFile=None, dtype=np.float32, numberOfParameters=None ):
+        if ( numberOfParameters is None ):
+            numberOfParameters = self.network.getNumberOfParameters()
+        shape = (2,self.populationSize,numberOfParameters)
+        if ( populationFile is None ):
+            self.buffers = np.zeros( shape, dtype=dtype )
+        else:
+            self.buffers = np.memmap( populationFile, dtype=dtype, mode="w+", shape=shape )
+        self.activeBuffer = 0
+        self.population = self.buffers[0]
+
+    def blocks( self ):
+        """
+        Yield the first and the last+1 chromosome of each block
+        """
+        for start in range(0,self.populationSize,self.blockSize):
+            yield start, min(start+self.blockSize, self.populationSize)
+
+    def chromosome( self, indx ):
+        """
+        Return the parameters of one chromosome in double precision
+        """
+        return self.population[indx].astype(np.float64)
+
     def generateNewInitialState( self ):
         """
         Initialize all weights and thresholds to random values
@@ -168,13 +326,8 @@ class GeneticAlgorithm:
         mean = 0.0
         # Want of the parameter z in each layer is in [-1,1]
         sigma = 4.0
-        for i in range(0,self.population.shape[1]):
-            slope = 2.0*np.random.rand()-1.0
-            exp = np.random.rand()*2.0
-            self.population[0,i] = np.random.normal( loc=mean, scale=sigma )
-            for j in range(1, self.population.shape[0] ):
-                #self.population[j,i] = self.population[j-1,i] + np.random.normal( loc=mean, scale=0.1*sigma )
-                self.population[j,i] = np.random.normal( loc=mean, scale=sigma )
+        for start, end in self.blocks():
+            self.population[start:end,:] = self.rng.normal( loc=mean, scale=sigma, size=(end-start,self.population.shape[1]) )
 
         # Set random threshols and write it back to the population array
         #for i in range(0,self.populationSize ):
@@ -183,7 +336,7 @@ class GeneticAlgorithm:
         #    self.population[:,i] -= np.mean( self.population[:,i] )
         #    self.population[:,i] = self.network.collectParameters()
         #    self.population[:,i] /= np.max( np.abs(self.population[:,i]) )
-        self.network.distribute( self.population[:,0] )
+        self.network.distribute( self.chromosome(0) )
 
     def nextChromosome( self, currentFitnessValue ):
         """
@@ -199,53 +352,51 @@ class GeneticAlgorithm:
             self.currentGeneration += 1
             print()
             print ("New generation created...")
-        chrom = self.population[:,self.currentChromosome]
-        self.network.distribute( self.population[:,self.currentChromosome] )
-
-    def selectParents( self ):
-        """
-        Selects parants for a chromosome
-        """
-        # Roulette selection
-        parents = []
-        fitnessCopy = []
-        for i in range(0,self.numberOfParents):
-            fitnessSum = np.sum(fitness)
-            random = np.random.rand(0.0,fitnessSum)
-            cumsum = 0.0
-            for i in range(0,len(fitness)):
-                cumsum += self.fitness[i]
-                if ( cumsum > random ):
-                    parents.append[i]
-                    fitnessCopy.append(self.fitness[i])
-
-                    # Set fitness to zero such that is not elected again
-                    self.fitness[i] = 0.0
-        # Reset the fitness
-        for i in range(0,len(parents)):
-            self.fitness[parents[i]] = fitnessCopy[i]
-        return parents
+        self.network.distribute( self.chromosome(self.currentChromosome) )
+
+    def selectParents( self, numberOfChildren ):
+        """
+        Roulette selection of numberOfParents different parents for each child.
+        Returns an array of shape (numberOfChildren, numberOfParents)
+        """
+        # Weighted sampling without replacement: add Gumbel noise to the log
+        # of the selection probabilities and keep the largest values
+        with np.errstate(divide="ignore"):
+            logFitness = np.log( self.fitness )
+        if ( not np.any(np.isfinite(logFitness)) ):
+            logFitness = np.zeros(self.populationSize)
+        keys = logFitness + self.rng.gumbel( size=(numberOfChildren,self.populationSize) )
+        return np.argpartition( -keys, self.numberOfParents-1, axis=1 )[:,:self.numberOfParents]
 
     def reproduce( self ):
         """
-        Produce a new generation
-        """
-        newGeneration = np.zeros(self.population.shape)
-
-        for i in range(0,self.population.shape[1]):
-            parents = self.parents()
-            for j in range(0,self.population.shape[0] ):
-                selectedParent = np.random.randint(0,high=self.numberOfParents)
-                newGeneration[j,i] = self.population[j,parents[selectedParent]]
-        del self.population
+        Produce a new generation by uniform crossover. Each gene of a child is
+        copied from one of its parents selected at random. The children are
+        written to the inactive buffer, which then becomes the population
+        """
+        parents = self.selectParents( self.populationSize )
+        newGeneration = self.buffers[1-self.activeBuffer]
+        for start, end in self.blocks():
+            parentGenes = self.population[parents[start:end].ravel()].reshape( (end-start,self.numberOfParents,-1) )
+            selectedParent = self.rng.integers( 0, self.numberOfParents, size=(end-start,1,parentGenes.shape[2]), dtype=np.int8 )
+            newGeneration[start:end,:] = np.take_along_axis( parentGenes, selectedParent, axis=1 )[:,0,:]
+        self.activeBuffer = 1-self.activeBuffer
         self.population = newGeneration
 
     def mutate( self ):
         """
-        Perform the mutation step. Mutation is done by assigning a random value to the selected gene
-        """
-        for i in range(0,self.populationSize):
-            for j in range(0,self.population.shape[0]):
-                if ( np.random.rand() < self.mutationProbability ):
-                    stddev = np.std( self.population.ravel() )
-                    self.population[j,i] = np.random.normal(loc=self.population[j,i],scale=std )
+        Perform the mutation step. A selected gene gets a normal distributed
+        perturbation with the standard deviation of the whole population
+        """
+        total = 0.0
+        totalSquared = 0.0
+        for start, end in self.blocks():
+            block = self.population[start:end].astype(np.float64)
+            total += np.sum(block)
+            totalSquared += np.sum(block**2)
+        n = self.population.size
+        stddev = np.sqrt( max( totalSquared/n - (total/n)**2, 0.0 ) )
+        for start, end in self.blocks():
+            block = self.population[start:end]
+            mutated = self.rng.random( block.shape ) < self.mutationProbability
+            block[mutated] += self.rng.normal( loc=0.0, scale=stddev, size=np.count_nonzero(mutated) ).astype(block.dtype)
@@ -0,0 +1,131 @@
+import game as gm
+import bitboard as bb
+import json
+import os
+import sys
+import time
+
+# Reference node counts for the start position and the test positions.
+# nodes[d-1] is the number of leaf positions at depth d
+REFERENCE_FILE = os.path.join( os.path.dirname(os.path.abspath(__file__)), "perftReference.json" )
+
+ENGINES = ["piece","bitboard"]
+
+def perft( game, depth ):
+    """
+    Count the leaf positions reached after depth moves from the current
+    position. Positions without moves count as zero at any depth above zero.
+    On a BitboardGame the moves come from the shift based generator of the
+    whole side (BitBoard.legalMoves) and are played with BitBoard.makeMove
+    """
+    if ( depth == 0 ):
+        return 1
+    player = game.playerToMove
+    if ( player == game.p1 ):
+        opponent = game.p2
+    else:
+        opponent = game.p1
+
+    moves = gm.legalMoves( player.pieces )
+    if ( depth == 1 ):
+        return len(moves)
+
+    nodes = 0
+    for piece, move, catchTree in moves:
+        game.move( piece, move, catchTree )
+        game.playerToMove = opponent
+        nodes += perft( game, depth-1 )
+        game.playerToMove = player
+        game.undoMove()
+    return nodes
+
+def newGame( position, engine ):
+    """
+    Return a game set up in the given reference position
+    """
+    if ( engine == "bitboard" ):
+        game = bb.BitboardGame()
+    else:
+        game = gm.Game()
+    if ( position["rows"] is None ):
+        game.setupGame()
+    else:
+        game.setupPosition( position["rows"], position["colorToMove"] )
+    return game
+
+def loadReference():
+    infile = open(REFERENCE_FILE, 'r')
+    reference = json.load(infile)
+    infile.close()
+    return reference
+
+def updateReference( maxDepth ):
+    """
+    Recompute the reference counts up to maxDepth. The counts are only
+    written if both engines agree
+    """
+    reference = loadReference()
+    for position in reference["positions"]:
+        position["nodes"] = []
+        for depth in range(1,maxDepth+1):
+            counts = [perft( newGame(position,engine), depth ) for engine in ENGINES]
+            if ( counts[0] != counts[1] ):
+                raise Exception("Engines disagree for position %s at depth %d: %s"%(position["name"], depth, str(counts)))
+            position["nodes"].append( counts[0] )
+        print ("%s: %s"%(position["name"], str(position["nodes"])))
+
+    out = open(REFERENCE_FILE, 'w')
+    json.dump( reference, out, indent=2 )
+    out.close()
+    print ("Reference counts written to %s"%(REFERENCE_FILE))
+
+def main( argv ):
+    if ( len(argv) > 2 ):
+        print ("Usage: python3 perft.py [maxDepth] [piece|bitboard]")
+        print ("       python3 perft.py update <maxDepth>")
+        return 1
+
+    if ( len(argv) == 2 and argv[0] == "update" ):
+        updateReference( int(argv[1]) )
+        return 0
+
+    # The reference counts go deeper, but depth 5 runs in a few seconds
+    maxDepth = 5
+    if ( len(argv) >= 1 ):
+        maxDepth = int(argv[0])
+    engine = "piece"
+    if ( len(argv) == 2 ):
+        engine = argv[1]
+    if ( not engine in ENGINES ):
+        print ("Unknown engine %s. Choose one of %s"%(engine, ", ".join(ENGINES)))
+        return 1
+
+    mismatches = 0
+    totalNodes = 0
+    totalTime = 0.0
+    for position in loadReference()["positions"]:
+        for depth in range(1,len(position["nodes"])+1):
+            if ( depth > maxDepth ):
+                break
+            game = newGame( position, engine )
+            start = time.time()
+            nodes = perft( game, depth )
+            diffSec = max( time.time()-start, 1E-9 )
+            totalNodes += nodes
+            totalTime += diffSec
+            expected = position["nodes"][depth-1]
+            status = "OK"
+            if ( nodes != expected ):
+                status = "MISMATCH (expected %d)"%(expected)
+                mismatches += 1
+            print ("%-14s depth %d: %10d nodes %8.3f s %10.0f nodes/s %s"%(position["name"], depth, nodes, diffSec, nodes/diffSec, status))
+
+    print ("Total: %d nodes in %.2f s (%.0f nodes/s) with the %s engine"%(totalNodes, totalTime, totalNodes/max(totalTime,1E-9), engine))
+    if ( mismatches > 0 ):
+        print ("%d node counts differ from the reference!"%(mismatches))
+        return 1
+    print ("All node counts match the reference")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main( sys.argv[1:] ) )
@@ -1,134 +1,99 @@
 import numpy as np
-import pygame as pg
 
-class MoveTree:
+# Zobrist keys indexed by [x][y][feature] where feature is the value returned by
+# Board.inputFeature seen from WHITE (0: empty, 1: white man, 2: white king,
+# 3: black man, 4: black king). Empty squares do not change the hash.
+zobristRandom = np.random.RandomState(1234)
+ZOBRIST_KEYS = [[[0]+[int(k) for k in zobristRandom.randint(1,2**62,size=4,dtype=np.int64)] for y in range(8)] for x in range(8)]
+ZOBRIST_BLACK_TO_MOVE = int( zobristRandom.randint(1,2**62,dtype=np.int64) )
+
+# Kinds of pieces and sides
+EMPTY = 0
+MAN = 1
+KING = 2
+KIND_NAMES = ["empty","man","king"]
+WHITE = 0
+BLACK = 1
+COLORS = ["white","black"]
+
+MAN_DIRECTIONS = [[(-1,1),(1,1)], [(-1,-1),(1,-1)]]
+KING_DIRECTIONS = [(1,1),(1,-1),(-1,-1),(-1,1)]
+
+class CaptureSequences:
+    """
+    All capture sequences of a piece. For every landing square it holds the
+    squares visited on the way and the squares of the captured pieces
+    """
     def __init__( self ):
-        self.entries = []
+        self.paths = {}
+        self.captured = {}
 
-    def toList( self ):
-        moves = []
-        for i in range(1,len(self.entries)):
-            moves.append( self.entries[i].move )
-        return moves
-
-    def hasDuplicates( self ):
-        for i in range(0,len(self.entries) ):
-            for j in range(i+1,len(self.entries)):
-                if ( self.entries[i] == self.entries[j] ):
-                    return True
-        return False
-
-    def clean( self ):
-        for entry in self.entries:
-            entry.nTimesVisited = 0
-
-class QuarticMoveTree(MoveTree):
-    def __init__( self ):
-        super().__init__()
-
-    def clean( self ):
-        for entry in self.entries:
-            entry.checked = [False,False,False,False]
-    def isInSearchTree( self, newmove ):
-        for entry in self.entries:
-            if ( newmove == entry.move ):
-                return True
-        return False
-
-    def getPath( self, x, y ):
-        moves = []
-        current = self.entries[0]
-        self.clean()
-        #moves.append(current.move)
-        maxIter = 1000
-        counter = 0
-        while ( True ):
-            counter += 1
-            if ( counter >= maxIter ):
-                raise Exception("Infinite loop when searching for path in quartic move tree")
-
-            proceedToNextLevel = False
-            for i in range(0,4):
-                if ( not current.checked[i] ):
-                    current.checked[i] = True
-                    moves.append(current.move)
-                    if ( moves[-1][0] == x and moves[-1][1] == y ):
-                        return moves
-                    if ( current.branches[i] is None ):
-                        del moves[-1]
-                    else:
-                        current = current.branches[i]
-                        proceedToNextLevel = True
-                        break
-            if ( proceedToNextLevel ):
-                continue
-
-            del moves[-1]
-            current = current.parent
-            if ( current is None ):
-                raise Exception("Error! Did not find path to for the current move")
+    def add( self, path, captured ):
+        landing = (path[-1][0],path[-1][1])
+        self.paths[landing] = path
+        self.captured[landing] = captured
 
-class BinaryMoveTree(MoveTree):
-    def __init__(self):
-        super().__init__()
+    def toList( self ):
+        return [[x,y] for (x,y) in self.paths.keys()]
 
     def getPath( self, x, y ):
-        moves = []
-        current = self.entries[0]
-        self.clean()
-        moves.append(current.move)
-        counter = 0
-        maxIter = 1000
-        while ( True ):
-            counter += 1
-            if ( counter >= maxIter ):
-                raise Exception("Infinite loop when searching for path in binary move tree")
-            current.nTimesVisited += 1
-            if ( not current.left is None and current.nTimesVisited == 1 ):
-                moves.append(current.left.move)
-                if ( moves[-1][0] == x and moves[-1][1] == y ):
-                    return moves
-                current = current.left
-                continue
+        return self.paths[(x,y)]
 
-            elif ( not current.right is None and current.nTimesVisited <= 2 ):
-                moves.append(current.right.move)
-                if ( moves[-1][0] == x and moves[-1][1] == y ):
-                    return moves
-                current = current.right
-                continue
-
-            del moves[-1]
-            current = current.parent
-            if ( current is None ):
-                raise Exception("Could not find path for the current move!")
-
-class BinaryMoveTreeEntry:
-    def __init__(self):
-        self.left = None
-        self.right = None
-        self.parent = None
-        self.move = []
-        self.nTimesVisited = 0
-
-class QuarticMoveTreeEntry:
-    def __init__(self):
-        self.branches = [None,None,None,None]
-        self.parent = None
-        self.move = []
-        self.nTimesVisited = 0
-        self.checked = [False,False,False,False]
+    def getCaptured( self, x, y ):
+        return self.captured[(x,y)]
 
 class Board:
     def __init__(self):
         self.board = [[None]*8 for _ in range(8)]
 
+        # Input state of the neural network seen from each side and the Zobrist
+        # hash of the position. Updated every time a square changes
+        self.inputStates = {"white":np.zeros(5*64)-0.25, "black":np.zeros(5*64)-0.25}
+        self.hash = 0
+
+        # Result of Piece.validMoves for each piece as (hash, result). The
+        # result is only used while the board has the hash it was generated at
+        self.moveCache = {}
+
     def getPiece( self, x, y ):
         assert( self.isInside(x,y) )
         return self.board[x][y]
 
     def setPiece( self, piece ):
-        self.board[piece.x][piece.y] = piece
+        self.placePiece( piece.x, piece.y, piece )
+
+    def placePiece( self, x, y, piece ):
+        """
+        Put piece on the square (x,y) and update the hash and the input states
+        """
+        old = self.board[x][y]
+        if ( not old is None ):
+            self.hash ^= ZOBRIST_KEYS[x][y][self.inputFeature(old,WHITE)]
+        self.hash ^= ZOBRIST_KEYS[x][y][self.inputFeature(piece,WHITE)]
+        self.board[x][y] = piece
+        indx = 5*(x*8+y)
+        for side in (WHITE,BLACK):
+            inputState = self.inputStates[COLORS[side]]
+            inputState[indx:indx+5] = -0.25
+            inputState[indx+self.inputFeature(piece,side)] = 1.0
+
+    def clearSquare( self, x, y ):
+        """
+        Make the square (x,y) empty
+        """
+        self.placePiece( x, y, EMPTY_SQUARE )
+
+    def inputFeature( self, piece, side ):
+        """
+        Return which of the five features of a square that is active for the
+        piece, seen from the given side. The features are empty, own man,
+        own king, opponent man and opponent king
+        """
+        if ( piece.kind == EMPTY ):
+            return 0
+        elif ( piece.side == side ):
+            return piece.kind
+        return piece.kind+2
 
     def isInside( self, x, y ):
         return x >= 0 and x < 8 and y >= 0 and y < 8
@@ -155,35 +120,92 @@ class Board:
                 raise Exception("Player %s and board does not show the same!"%(player.name))
 
 class Piece:
-    board = Board() # All Pieces share the same board
-
-    def __init__( self ):
+    """
+    A piece on the board. The kind (EMPTY, MAN or KING) and the side (WHITE or
+    BLACK) are stored as integers. Men are promoted in place
+    """
+    __slots__ = ("board","x","y","kind","side")
+    guiRadiusInPx = 30
+
+    def __init__( self, board, kind=EMPTY, side=WHITE ):
+        self.board = board
         self.x = 0
         self.y = 0
-        self.color = "white"
-        self.name = "empty"
+        self.kind = kind
+        self.side = side
+
+    @property
+    def name( self ):
+        return KIND_NAMES[self.kind]
+
+    @property
+    def color( self ):
+        return COLORS[self.side]
+
+    @color.setter
+    def color( self, color ):
+        self.side = COLORS.index(color)
+
+    def promote( self ):
+        """
+        Turn a man into a king
+        """
+        self.board.clearSquare( self.x, self.y )
+        self.kind = KING
+        self.__class__ = King
+        self.board.setPiece( self )
+
+    def demote( self ):
+        """
+        Turn a king back into a man, used when a promotion is undone
+        """
+        self.board.clearSquare( self.x, self.y )
+        self.kind = MAN
+        self.__class__ = Man
+        self.board.setPiece( self )
 
     def validMoves( self ):
+        """
+        Return the valid moves and the capture sequences of the piece. The
+        result is cached until the position changes, and it is reused when a
+        move is undone and the same position is reached again
+        """
+        cached = self.board.moveCache.get(self)
+        if ( not cached is None and cached[0] == self.board.hash ):
+            return cached[1]
         allMoves = []
         allMoves =  self.validRegularMoves()
         catchMoves =  self.validCatchMoves()
         allMoves += catchMoves.toList()
+        self.board.moveCache[self] = (self.board.hash, (allMoves, catchMoves))
         return allMoves, catchMoves
 
-    def validRegularMoves( self ):
-        raise NotImplementedError( "This function must be implemented by child" )
-
-    def validCatchMoves( self ):
-        raise NotImplementedError( "This function must be implemented by child" )
-
-    def draw( self, screen, tilewidth, tileheight ):
-        raise NotImplementedError( "The draw function should be implemented in child classes" )
+    def hasValidMove( self ):
+        """
+        Return True if the piece has at least one valid move. Only the first
+        jump of captures is checked, so no capture sequences are searched
+        """
+        cached = self.board.moveCache.get(self)
+        if ( not cached is None and cached[0] == self.board.hash ):
+            return len(cached[1][0]) > 0
+        for dx, dy in self.directions():
+            if ( not self.board.isInside(self.x+dx,self.y+dy) ):
+                continue
+            neighbour = self.board.getPiece(self.x+dx,self.y+dy)
+            if ( neighbour.kind == EMPTY ):
+                return True
+            if ( neighbour.side != self.side and self.board.isInside(self.x+2*dx,self.y+2*dy) and
+            self.board.getPiece(self.x+2*dx,self.y+2*dy).kind == EMPTY ):
+                return True
+        return False
 
-class Man( Piece ):
-    def __init__( self ):
-        super().__init__()
-        self.name = "man"
-        self.guiRadiusInPx = 30
+    def directions( self ):
+        """
+        Return the diagonal steps the piece can move along
+        """
+        if ( self.kind == KING ):
+            return KING_DIRECTIONS
+        return MAN_DIRECTIONS[self.side]
 
     def validRegularMoves( self ):
         """
@@ -192,210 +214,76 @@ class Man( Piece ):
         the coordinates of the new move
         """
         moves = []
-        x1 = self.x + 1
-        if ( self.color == "white" ):
-            y1 = self.y + 1
-        else:
-            y1 = self.y - 1
-
-        if ( self.board.isInside(x1,y1) ):
-            if ( self.board.getPiece(x1,y1).name == "empty" ):
+        for dx, dy in self.directions():
+            x1 = self.x + dx
+            y1 = self.y + dy
+            if ( self.board.isInside(x1,y1) and self.board.getPiece(x1,y1).kind == EMPTY ):
                 moves.append([x1,y1])
-
-        x2 = self.x - 1
-        if ( self.color == "white" ):
-            y2 = self.y + 1
-        else:
-            y2 = self.y - 1
-
-        if ( self.board.isInside(x2,y2) ):
-            if ( self.board.getPiece(x2,y2).name == "empty" ):
-                moves.append([x2,y2])
         return moves
 
     def validCatchMoves( self ):
-        moves = []
-        tree = BinaryMoveTree()
-        rootMove = BinaryMoveTreeEntry()
-        rootMove.move = [self.x,self.y]
-        tree.entries.append(rootMove)
-
-        current = rootMove
-        counter = 0
-        maxIter = 1000
-        while ( True ):
-            counter += 1
-            if ( counter >= maxIter ):
-                raise Exception("Infinite loop in search tree for class %s"%(self.name))
-            current.nTimesVisited += 1
-            # Check right of the current node
-            if ( current.nTimesVisited == 1 ):
-                newmove = self.findCatchMove( current.move[0], current.move[1], True )
-                if ( len(newmove) > 0 ):
-                    newEntry = BinaryMoveTreeEntry()
-                    newEntry.move = newmove
-                    newEntry.parent = current
-                    current.right = newEntry
-                    current = newEntry
-                    tree.entries.append(current)
-                    continue
-
-            # Check left node
-            if ( current.nTimesVisited == 2 or current.nTimesVisited == 1 ):
-                newmove = self.findCatchMove( current.move[0], current.move[1], False )
-                if ( len(newmove) > 0 ):
-                    newEntry = BinaryMoveTreeEntry()
-                    newEntry.move = newmove
-                    newEntry.parent = current
-                    current.left = newEntry
-                    current = newEntry
-                    tree.entries.append(current)
-                    continue
-
-            # If it enters here go back to parent
-            current = current.parent
-            if ( current is None ):
-                break
-            if ( current == rootMove and rootMove.nTimesVisited == 3 ):
-                break
-        return tree
-
-
-    def findCatchMove( self, x, y, checkRight ):
-        if ( checkRight ):
-            x1 = x+1
-        else:
-            x1 = x-1
-
-        if ( self.color == "white" ):
-            y1 = y+1
-        else:
-            y1 = y-1
-
-        if ( self.board.isInside(x1,y1) and self.board.getPiece(x1,y1).name != "empty" and
-        self.board.getPiece(x1,y1).color != self.color ):
-            if ( checkRight ):
-                x2 = x1+1
-            else:
-                x2 = x1-1
-            if ( self.color == "white" ):
-                y2 = y1+1
-            else:
-                y2 = y1-1
-            if ( self.board.isInside(x2,y2) and self.board.getPiece(x2,y2).name == "empty" ):
-                return [x2,y2]
-        return []
+        """
+        Return the capture sequences of the piece. A piece may stop after any
+        jump in a sequence, so every landing square is a valid move
+        """
+        sequences = CaptureSequences()
+        self.searchCaptures( self.x, self.y, [[self.x,self.y]], [], sequences, set([(self.x,self.y)]) )
+        return sequences
 
+    def searchCaptures( self, x, y, path, captured, sequences, visited ):
+        """
+        Depth first search for jumps from (x,y) in the directions of the piece.
+        Each landing square is only reached once, through the first path found
+        """
+        for dx, dy in self.directions():
+            landX = x+2*dx
+            landY = y+2*dy
+            if ( not self.board.isInside(landX,landY) or (landX,landY) in visited ):
+                continue
+            middle = self.board.getPiece(x+dx,y+dy)
+            if ( middle.kind == EMPTY or middle.side == self.side or [x+dx,y+dy] in captured ):
+                continue
+            if ( self.board.getPiece(landX,landY).kind != EMPTY ):
+                continue
+            visited.add( (landX,landY) )
+            newPath = path+[[landX,landY]]
+            newCaptured = captured+[[x+dx,y+dy]]
+            sequences.add( newPath, newCaptured )
+            self.searchCaptures( landX, landY, newPath, newCaptured, sequences, visited )
 
     def draw( self, screen, tilewidth, tileheight ):
         """
         This function draws a graphical representation on the screen
         """
-        if ( self.color == "white" ):
+        # pygame is only needed by the GUI
+        import pygame as pg
+        if ( self.kind == EMPTY ):
+            return
+        if ( self.side == WHITE ):
             color = (255,255,255)
         else:
             color = (0,0,0)
         xPx = int( self.x*tilewidth+tilewidth/2.0 )
         yPx = int( self.y*tileheight+tileheight/2.0 )
         pg.draw.circle( screen, color, (xPx,yPx), self.guiRadiusInPx, 0 )
+        if ( self.kind == KING ):
+            colorSq = (228,26,28)
+            width = self.guiRadiusInPx*0.5
+            pg.draw.rect( screen, colorSq, (xPx-0.5*width,yPx-0.5*width,width,width), 0 )
 
-class King(Piece):
-    def __init__(self):
-        super().__init__()
-        self.name = "king"
-        self.guiRadiusInPx = 30
-
-    def validRegularMoves( self ):
-        moves = []
-        x1 = [self.x+1,self.x+1,self.x-1,self.x-1]
-        y1 = [self.y+1,self.y-1,self.y+1,self.y-1]
-        for i in range(0,len(x1)):
-            if ( self.board.isInside(x1[i],y1[i]) and self.board.getPiece(x1[i],y1[i]).name == "empty" ):
-                moves.append([x1[i],y1[i]])
-        return moves
+class Man( Piece ):
+    __slots__ = ()
 
-    def validCatchMoves( self ):
-        moves = []
-        tree = QuarticMoveTree()
-        rootMove = QuarticMoveTreeEntry()
-        rootMove.move = [self.x,self.y]
-        tree.entries.append(rootMove)
-
-        current = rootMove
-        maxIter = 1000
-        counter = 0
-        directions = ["ne", "se", "sw", "nw"]
-        while ( True ):
-            counter += 1
-            if ( counter >= maxIter ):
-                raise Exception("Infinite loop in search tree for valid moves in class %s"%(self.name))
-            moveFound = False
-            # Check right of the current node
-            for i in range(0,4):
-                if ( not current.checked[i] ):
-                    current.checked[i] = True
-                    newmove = self.findCatchMove( current.move[0], current.move[1], direction=directions[i] )
-                    if ( len(newmove) > 0 and not tree.isInSearchTree(newmove) ):
-                        newEntry = QuarticMoveTreeEntry()
-                        newEntry.move = newmove
-                        newEntry.parent = current
-                        current.branches[i] = newEntry
-                        current = newEntry
-                        tree.entries.append(current)
-                        moveFound = True
-                        break
-            if ( moveFound ):
-                continue
+    def __init__( self, board, side=WHITE ):
+        super().__init__(board, kind=MAN, side=side)
 
-            # If it enters here go back to parent
-            current = current.parent
-            if ( current is None ):
-                # Back to the root node
-                break
-        assert( not tree.hasDuplicates() )
-        return tree
-
-    def findCatchMove( self, x, y, direction="nw" ):
-        if ( direction == "ne" ):
-            x1 = x + 1
-            y1 = y + 1
-            x2 = x + 2
-            y2 = y + 2
-        elif ( direction == "se" ):
-            x1 = x+1
-            y1 = y-1
-            x2 = x+2
-            y2 = y-2
-        elif ( direction == "sw" ):
-            x1 = x-1
-            y1 = y-1
-            x2 = x-2
-            y2 = y-2
-        elif ( direction == "nw" ):
-            x1 = x-1
-            y1 = y+1
-            x2 = x-2
-            y2 = y+2
-        else:
-            raise Exception("Unknown direction in find path in class %s"%(self.name))
+class King(Piece):
+    __slots__ = ()
 
-        if ( self.board.isInside(x1,y1) and self.board.getPiece(x1,y1).color != self.color and
-        self.board.getPiece(x1,y1).name != "empty"):
-            if ( self.board.isInside(x2,y2) and self.board.getPiece(x2,y2).name == "empty" ):
-                return [x2,y2]
-        return []
+    def __init__( self, board, side=WHITE ):
+        super().__init__(board, kind=KING, side=side)
 
-    def draw( self, screen, tilewidth, tileheight ):
-        """
-        This function draws a graphical representation on the screen
-        """
-        if ( self.color == "white" ):
-            color = (255,255,255)
-        else:
-            color = (0,0,0)
-        colorSq = (228,26,28)
-        width = self.guiRadiusInPx*0.5
-        xPx = int( self.x*tilewidth+tilewidth/2.0 )
-        yPx = int( self.y*tileheight+tileheight/2.0 )
-        pg.draw.circle( screen, color, (xPx,yPx), self.guiRadiusInPx, 0 )
-        pg.draw.rect( screen, colorSq, (xPx-0.5*width,yPx-0.5*width,width,width), 0 )
+# All empty squares on all boards refer to this piece
+EMPTY_SQUARE = Piece( None )
+EMPTY_SQUARE.x = -1
+EMPTY_SQUARE.y = -1
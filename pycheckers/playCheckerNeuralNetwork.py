@@ -1,14 +1,15 @@
 import gui as pychgui
 import game as gm
 import neuralNetwork as nn
-import pickle as pck
+import os
 
 def main():
-    fname = "trainedNetwork.pkl"
+    fname = "trainedNetwork.npz"
+    if ( not os.path.exists(fname) ):
+        fname = "trainedNetwork.pkl"
 
     try:
-        networkfile = open(fname, 'rb')
-        network = pck.load( networkfile )
+        network = nn.loadNetwork( fname )
     except Exception as exc:
         print (str(exc))
         neurons = [5*64,int(0.66*5*64),1]
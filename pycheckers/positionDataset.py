@@ -0,0 +1,162 @@
+import game as gm
+import gameRecord as gr
+import numpy as np
+import itertools
+import os
+import sys
+
+# Length of the input states in Board.inputStates. Each input is either 1.0
+# or -0.25, so a state is stored as one bit per input
+INPUT_SIZE = 5*64
+PACKED_SIZE = INPUT_SIZE//8
+
+def packStates( inputStates ):
+    return np.packbits( np.asarray(inputStates) > 0.0, axis=-1 )
+
+def unpackStates( packed ):
+    """
+    Return the input states in the layout of Board.inputStates
+    """
+    bits = np.unpackbits( packed, axis=-1 )
+    return bits*1.25 - 0.25
+
+def positionOutcomes( player1ToMove, winner ):
+    """
+    Return the outcome seen from the side to move (1 win, 0 draw, -1 loss)
+    of every position, given whether player 1 was to move
+    """
+    player1ToMove = np.asarray( player1ToMove, dtype=bool )
+    if ( winner == "draw" ):
+        return np.zeros( len(player1ToMove), dtype=np.int8 )
+    return np.where( player1ToMove == (winner == "p1"), 1, -1 ).astype(np.int8)
+
+def gamePositions( moves, winner ):
+    """
+    Replay a game and return, for the position before every move, the packed
+    input state seen from the side to move, the outcome seen from the same
+    side and the move number. Games played by selfPlay.playTrainingGame
+    collect their positions while they are played, so replaying is only
+    needed for games read from a record file
+    """
+    n = len(moves)
+    packed = np.zeros( (n,PACKED_SIZE), dtype=np.uint8 )
+    player1ToMove = np.zeros( n, dtype=bool )
+    if ( n == 0 ):
+        return packed, np.zeros( 0, dtype=np.int8 ), np.zeros( 0, dtype=np.int16 )
+    game = gm.Game()
+    game.setupGame()
+    positions = itertools.chain( [game], gr.replay(moves[:-1], game) )
+    for i, position in enumerate(positions):
+        player = position.playerToMove
+        packed[i] = packStates( position.board.inputStates[player.color] )
+        player1ToMove[i] = player == position.p1
+    return packed, positionOutcomes(player1ToMove, winner), np.arange(n, dtype=np.int16)
+
+class PositionDatasetWriter:
+    """
+    Collects positions and writes them to shards of shardSize positions in
+    directory. Each shard consists of the files states_<n>.npy,
+    outcomes_<n>.npy and moveNumbers_<n>.npy. New shards are numbered after
+    the shards already in the directory
+    """
+    def __init__( self, directory, shardSize=100000 ):
+        self.directory = directory
+        self.shardSize = shardSize
+        os.makedirs( directory, exist_ok=True )
+        self.nextShard = len(shardNames(directory))
+        self.buffers = ([],[],[])
+        self.bufferedPositions = 0
+        self.numberOfPositions = 0
+
+    def addGame( self, moves, winner ):
+        self.addPositions( *gamePositions(moves, winner) )
+
+    def addPositions( self, packed, outcomes, moveNumbers ):
+        for buffer, values in zip(self.buffers, (packed, outcomes, moveNumbers)):
+            buffer.append( values )
+        self.bufferedPositions += len(outcomes)
+        self.numberOfPositions += len(outcomes)
+        while ( self.bufferedPositions >= self.shardSize ):
+            self.writeShard( self.shardSize )
+
+    def writeShard( self, size ):
+        """
+        Write the first size buffered positions as a new shard. The files are
+        written under a temporary name and renamed, so readers never see a
+        partially written shard
+        """
+        joined = [np.concatenate(buffer) for buffer in self.buffers]
+        name = "%05d"%(self.nextShard)
+        for prefix, values in zip(["states","outcomes","moveNumbers"], joined):
+            fname = os.path.join( self.directory, "%s_%s.npy"%(prefix,name) )
+            np.save( fname+".tmp.npy", values[:size] )
+            os.replace( fname+".tmp.npy", fname )
+        self.nextShard += 1
+        self.buffers = tuple( [values[size:]] for values in joined )
+        self.bufferedPositions -= size
+
+    def close( self ):
+        if ( self.bufferedPositions > 0 ):
+            self.writeShard( self.bufferedPositions )
+
+def shardNames( directory ):
+    """
+    Return the names of the complete shards in directory
+    """
+    names = []
+    for fname in sorted(os.listdir(directory)):
+        if ( fname.startswith("moveNumbers_") and fname.endswith(".npy") and not fname.endswith(".tmp.npy") ):
+            names.append( fname[len("moveNumbers_"):-len(".npy")] )
+    return names
+
+class PositionDataset:
+    """
+    All shards in a directory. The shards are memory mapped, so mini-batches
+    can be sampled without loading the positions into memory
+    """
+    def __init__( self, directory ):
+        self.states = []
+        self.outcomes = []
+        self.moveNumbers = []
+        for name in shardNames(directory):
+            self.states.append( np.load( os.path.join(directory,"states_%s.npy"%(name)), mmap_mode='r' ) )
+            self.outcomes.append( np.load( os.path.join(directory,"outcomes_%s.npy"%(name)), mmap_mode='r' ) )
+            self.moveNumbers.append( np.load( os.path.join(directory,"moveNumbers_%s.npy"%(name)), mmap_mode='r' ) )
+        self.shardStart = np.cumsum( [0]+[len(outcomes) for outcomes in self.outcomes] )
+
+    def __len__( self ):
+        return int(self.shardStart[-1])
+
+    def sample( self, batchSize, rng=None ):
+        """
+        Return the input states, outcomes and move numbers of batchSize
+        randomly selected positions
+        """
+        if ( rng is None ):
+            rng = np.random.default_rng()
+        indices = np.sort( rng.integers(0, len(self), size=batchSize) )
+        shard = np.searchsorted( self.shardStart, indices, side="right" )-1
+        packed = np.zeros( (batchSize,PACKED_SIZE), dtype=np.uint8 )
+        outcomes = np.zeros( batchSize, dtype=np.int8 )
+        moveNumbers = np.zeros( batchSize, dtype=np.int16 )
+        for s in np.unique(shard):
+            rows = np.flatnonzero( shard == s )
+            local = indices[rows]-self.shardStart[s]
+            packed[rows] = self.states[s][local]
+            outcomes[rows] = self.outcomes[s][local]
+            moveNumbers[rows] = self.moveNumbers[s][local]
+        return unpackStates(packed), outcomes, moveNumbers
+
+def main( argv ):
+    if ( len(argv) != 2 ):
+        print ("Usage: python3 positionDataset.py <gameRecordFile> <datasetDirectory>")
+        return
+
+    writer = PositionDatasetWriter( argv[1] )
+    for result, moves in gr.GameRecordReader( argv[0] ):
+        writer.addGame( moves, result )
+    writer.close()
+    print ("%d positions written to %s"%(writer.numberOfPositions, argv[1]))
+
+if __name__ == "__main__":
+    main( sys.argv[1:] )
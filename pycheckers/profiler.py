@@ -0,0 +1,123 @@
+import game as gm
+import bitboard as bb
+import piece as pc
+import neuralNetwork as nn
+import json
+import time
+
+class Profiler:
+    """
+    Accumulates the wall time and the number of calls of each phase of a game,
+    and counters such as the number of moves generated. When enabled the
+    methods of the phases are replaced by timed wrappers, and when disabled
+    the original methods are put back, so profiling costs nothing unless it
+    is enabled. The time of a phase includes the phases called from it
+    """
+    def __init__( self ):
+        self.enabled = False
+        self.originals = []
+        self.reset()
+
+    def reset( self ):
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+
+    def add( self, phase, seconds ):
+        self.times[phase] = self.times.get(phase,0.0) + seconds
+        self.calls[phase] = self.calls.get(phase,0) + 1
+
+    def count( self, counter, n=1 ):
+        self.counters[counter] = self.counters.get(counter,0) + n
+
+    def wrap( self, cls, method, phase, counter=None, amount=None ):
+        """
+        Replace cls.method by a wrapper that adds its wall time to phase. If
+        counter is given, amount(result) is added to it after each call. If
+        phase is None, the calls are only counted
+        """
+        original = cls.__dict__[method]
+        profiler = self
+        def timed( *args, **kwargs ):
+            start = time.perf_counter()
+            result = original( *args, **kwargs )
+            if ( not phase is None ):
+                profiler.add( phase, time.perf_counter()-start )
+            if ( not counter is None ):
+                profiler.count( counter, amount(result) )
+            return result
+        setattr( cls, method, timed )
+        self.originals.append( (cls, method, original) )
+
+    def enable( self ):
+        if ( self.enabled ):
+            return
+        self.enabled = True
+        for policy in [gm.RandomMover, gm.HumanUser, gm.CleverMover, gm.AlphaBetaMover]:
+            self.wrap( policy, "getMove", "getMove" )
+        # Moves served from the move cache are not counted as generated
+        self.wrap( pc.Piece, "validMoves", "validMoves" )
+        self.wrap( pc.Piece, "validRegularMoves", None, "movesGenerated", lambda result: len(result) )
+        self.wrap( pc.Piece, "validCatchMoves", None, "movesGenerated", lambda result: len(result.paths) )
+
+        # Encoding the positions after all candidate moves of the network
+        self.wrap( gm.CleverMover, "candidateInputStates", "boardToInputState" )
+        self.wrap( nn.Network, "evaluate", "evaluate", "positionsEvaluated", lambda result: 1 )
+        self.wrap( nn.Network, "evaluateBatch", "evaluate", "positionsEvaluated", lambda result: len(result) )
+        self.wrap( gm.Game, "stepGame", "stepGame" )
+        self.wrap( gm.Game, "move", "move" )
+        self.wrap( gm.Game, "undoMove", "undoMove" )
+
+        # Games played on the bitboard engine generate all moves of a side at once
+        self.wrap( bb.BitPieces, "legalMoves", "validMoves", "movesGenerated", lambda result: len(result) )
+        self.wrap( bb.BitboardGame, "move", "move" )
+        self.wrap( bb.BitboardGame, "undoMove", "undoMove" )
+
+    def disable( self ):
+        if ( not self.enabled ):
+            return
+        self.enabled = False
+        for cls, method, original in reversed(self.originals):
+            setattr( cls, method, original )
+        self.originals = []
+
+    def toDict( self ):
+        phases = {}
+        for phase in self.times.keys():
+            phases[phase] = {"seconds":self.times[phase], "calls":self.calls[phase]}
+        return {"phases":phases, "counters":dict(self.counters)}
+
+    def collect( self ):
+        """
+        Return the statistics gathered so far and start over. Used to send the
+        statistics from a worker process to the main process
+        """
+        stats = self.toDict()
+        self.reset()
+        return stats
+
+    def merge( self, stats ):
+        """
+        Add statistics returned by collect
+        """
+        for phase, entry in stats["phases"].items():
+            self.times[phase] = self.times.get(phase,0.0) + entry["seconds"]
+            self.calls[phase] = self.calls.get(phase,0) + entry["calls"]
+        for counter, n in stats["counters"].items():
+            self.count( counter, n )
+
+    def save( self, fname ):
+        out = open(fname, 'w')
+        json.dump( self.toDict(), out, indent=2 )
+        out.close()
+        print ("Profile written to %s"%(fname))
+
+    def printOut( self ):
+        for phase in sorted(self.times.keys(), key=lambda p: -self.times[p]):
+            calls = self.calls[phase]
+            print ("%-18s %10.3f s %10d calls %10.2f us/call"%(phase, self.times[phase], calls, 1E6*self.times[phase]/calls))
+        for counter in sorted(self.counters.keys()):
+            print ("%-18s %10d"%(counter, self.counters[counter]))
+
+# Profiler shared by the whole process
+PROFILER = Profiler()
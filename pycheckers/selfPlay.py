@@ -0,0 +1,262 @@
+import game as gm
+import bitboard as bb
+import profiler as prof
+import gameRecord as gr
+import positionDataset as pds
+import numpy as np
+import copy
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+class SelfPlayRunner:
+    """
+    Plays games in a pool of worker processes and returns the results
+    as the games finish
+    """
+    def __init__( self, numberOfProcesses=None, initializer=None, initargs=() ):
+        if ( numberOfProcesses is None ):
+            numberOfProcesses = os.cpu_count()
+        self.numberOfProcesses = numberOfProcesses
+        self.executor = None
+        if ( self.numberOfProcesses > 1 ):
+            self.executor = ProcessPoolExecutor( max_workers=numberOfProcesses, initializer=initializer, initargs=initargs )
+        elif ( not initializer is None ):
+            initializer( *initargs )
+
+        # Keep some extra games queued such that no worker waits for the main process
+        self.maxGamesInFlight = 2*self.numberOfProcesses
+
+    def run( self, playGame, tasks, endTime=None ):
+        """
+        Call playGame(*task) for each task and yield (task,result) in the order
+        the games finish. No new games are started after endTime, but games
+        that are already started are completed.
+        """
+        tasks = iter(tasks)
+        if ( self.executor is None ):
+            for task in tasks:
+                if ( not endTime is None and time.time() >= endTime ):
+                    return
+                yield task, playGame(*task)
+            return
+
+        running = {}
+        exhausted = False
+        while ( True ):
+            while ( not exhausted and len(running) < self.maxGamesInFlight ):
+                if ( not endTime is None and time.time() >= endTime ):
+                    exhausted = True
+                    break
+                try:
+                    task = next(tasks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                running[self.executor.submit( playGame, *task )] = task
+
+            if ( len(running) == 0 ):
+                return
+            done, notDone = wait( running.keys(), return_when=FIRST_COMPLETED )
+            for future in done:
+                yield running.pop(future), future.result()
+
+    def close( self ):
+        if ( not self.executor is None ):
+            self.executor.shutdown()
+
+def gameResult( game ):
+    """
+    Summary of a finished game that is cheap to send between processes
+    """
+    winner = "draw"
+    if ( game.p1.winner ):
+        winner = "p1"
+    elif ( game.p2.winner ):
+        winner = "p2"
+    result = {"winner":winner, "numberOfTurns":game.numberOfTurns, "moves":gr.encodeGame(game)}
+    if ( prof.PROFILER.enabled ):
+        result["profile"] = prof.PROFILER.collect()
+    return result
+
+# Game classes the self-play games can be played with
+ENGINES = {"piece":gm.Game, "bitboard":bb.BitboardGame}
+
+def playRandomGame( seed, engine="piece" ):
+    """
+    Play a game between two random players
+    """
+    np.random.seed(seed)
+    game = ENGINES[engine]()
+    game.setupGame()
+    while ( game.state != "finished" ):
+        game.stepGame()
+    return gameResult(game)
+
+# Network used by playTrainingGame in the worker processes, whether the
+# positions of the games are returned for the position dataset and the
+# engine the games are played with
+workerNetwork = None
+workerCollectsPositions = False
+workerEngine = "piece"
+
+def evaluationCopy( network ):
+    """
+    Return a copy of the network without the genetic algorithm. This is what
+    is sent to the worker processes.
+    """
+    ga = network.ga
+    network.ga = None
+    evaluator = copy.deepcopy(network)
+    network.ga = ga
+    return evaluator
+
+def initNetworkWorker( network, profile=False, positions=False, engine="piece" ):
+    global workerNetwork, workerCollectsPositions, workerEngine
+    workerNetwork = network
+    workerCollectsPositions = positions
+    workerEngine = engine
+    if ( profile ):
+        prof.PROFILER.enable()
+
+def playTrainingGame( parameters, seed ):
+    """
+    Play a training game where the network uses the given parameters.
+    Player 2 is controlled by the network, player 1 makes three random moves
+    before it is also controlled by the network. If the worker collects
+    positions, the result holds the packed states, outcomes and move numbers
+    of the positions before every move, as given by pds.gamePositions
+    """
+    np.random.seed(seed)
+    workerNetwork.distribute( parameters )
+    game = ENGINES[workerEngine]()
+    game.setupGame()
+    game.p2.setNeuralNetwork( workerNetwork, game )
+    counter = 0
+    packed = []
+    player1ToMove = []
+    while ( game.state != "finished" ):
+        if ( workerCollectsPositions ):
+            packed.append( pds.packStates(game.board.inputStates[game.playerToMove.color]) )
+            player1ToMove.append( game.playerToMove == game.p1 )
+        game.stepGame()
+        counter += 1
+        if ( counter >= 4 ):
+            game.p1.setNeuralNetwork( workerNetwork, game )
+    result = gameResult(game)
+    if ( workerCollectsPositions ):
+        # No move is made at the last turn if the side to move was blocked
+        n = len(result["moves"])
+        packed = np.array( packed[:n], dtype=np.uint8 ).reshape(n,pds.PACKED_SIZE)
+        result["positions"] = (packed, pds.positionOutcomes(player1ToMove[:n], result["winner"]), np.arange(n, dtype=np.int16))
+    return result
+
+def playEvaluationGame( chromosome, game, parameters, seed ):
+    """
+    Play a task of GenerationEvaluation.tasks. The chromosome and the index
+    of the game only identify the task when the result comes back
+    """
+    return playTrainingGame( parameters, seed )
+
+class GenerationEvaluation:
+    """
+    Plays the same set of games, given by their seeds, for every chromosome
+    of a generation (common random numbers). The games are played round by
+    round, and after minimumGames rounds a chromosome whose average fitness is
+    below the cutoffQuantile of the other averages plays no more games
+    """
+    def __init__( self, chromosomes, seeds, minimumGames=2, cutoffQuantile=0.25 ):
+        self.chromosomes = list(chromosomes)
+        self.seeds = seeds
+        self.minimumGames = minimumGames
+        self.cutoffQuantile = cutoffQuantile
+        self.fitnessSum = {i:0.0 for i in self.chromosomes}
+        self.gamesStarted = {i:0 for i in self.chromosomes}
+        self.gamesPlayed = {i:0 for i in self.chromosomes}
+        self.playedGames = {i:set() for i in self.chromosomes}
+        self.stopped = set()
+
+    def toArrays( self ):
+        """
+        Return the games played so far as a dictionary of arrays, which can be
+        stored in a checkpoint. Games that are still running are not included
+        """
+        played = np.zeros( (len(self.chromosomes),len(self.seeds)), dtype=bool )
+        for row, i in enumerate(self.chromosomes):
+            played[row,list(self.playedGames[i])] = True
+        return {
+            "chromosomes":np.array( self.chromosomes, dtype=np.int64 ),
+            "seeds":np.array( self.seeds, dtype=np.int64 ),
+            "fitnessSum":np.array( [self.fitnessSum[i] for i in self.chromosomes] ),
+            "played":played,
+            "stopped":np.array( [i in self.stopped for i in self.chromosomes] ),
+            "minimumGames":np.array(self.minimumGames),
+            "cutoffQuantile":np.array(self.cutoffQuantile)
+        }
+
+    def averageFitness( self, chromosome ):
+        if ( self.gamesPlayed[chromosome] == 0 ):
+            return 0.0
+        return self.fitnessSum[chromosome]/self.gamesPlayed[chromosome]
+
+    def cutoff( self ):
+        """
+        Average fitness below which a chromosome is stopped
+        """
+        averages = [self.averageFitness(i) for i in self.chromosomes if self.gamesPlayed[i] >= self.minimumGames]
+        if ( len(averages) < 2 ):
+            return -np.inf
+        return np.quantile( averages, self.cutoffQuantile )
+
+    def tasks( self, parameters ):
+        """
+        Yield (chromosome, game, parameters, seed) tasks for
+        playEvaluationGame, where game is the index of the seed. parameters(i)
+        returns the parameters of chromosome i
+        """
+        for game in range(0,len(self.seeds)):
+            cutoff = -np.inf
+            if ( game >= self.minimumGames ):
+                cutoff = self.cutoff()
+            for i in self.chromosomes:
+                if ( i in self.stopped or game in self.playedGames[i] ):
+                    continue
+                if ( self.gamesPlayed[i] >= self.minimumGames and self.averageFitness(i) < cutoff ):
+                    self.stopped.add(i)
+                    continue
+                self.gamesStarted[i] += 1
+                yield (i, game, parameters(i), self.seeds[game])
+
+    def addResult( self, task, fitness ):
+        """
+        Register the fitness obtained in the game played for task
+        """
+        i, game = task[:2]
+        self.fitnessSum[i] += fitness
+        self.gamesPlayed[i] += 1
+        self.playedGames[i].add(game)
+
+    def isFinished( self, chromosome ):
+        """
+        True when no more games will be played for the chromosome
+        """
+        if ( self.gamesPlayed[chromosome] < self.gamesStarted[chromosome] ):
+            return False
+        return chromosome in self.stopped or self.gamesStarted[chromosome] == len(self.seeds)
+
+def restoreEvaluation( arrays ):
+    """
+    Continue an evaluation stored with GenerationEvaluation.toArrays. Only
+    the games that were not finished are played
+    """
+    seeds = [int(seed) for seed in arrays["seeds"]]
+    evaluation = GenerationEvaluation( [int(i) for i in arrays["chromosomes"]], seeds, minimumGames=int(arrays["minimumGames"]),
+                                       cutoffQuantile=float(arrays["cutoffQuantile"]) )
+    for row, i in enumerate(evaluation.chromosomes):
+        evaluation.fitnessSum[i] = float(arrays["fitnessSum"][row])
+        evaluation.playedGames[i] = set( int(game) for game in np.flatnonzero(arrays["played"][row]) )
+        evaluation.gamesPlayed[i] = len(evaluation.playedGames[i])
+        evaluation.gamesStarted[i] = evaluation.gamesPlayed[i]
+        if ( arrays["stopped"][row] ):
+            evaluation.stopped.add(i)
+    return evaluation
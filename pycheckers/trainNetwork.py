@@ -1,79 +1,160 @@
-import gui as pychgui
-import game as gm
 import sys
 import time
-import pickle as pck
+import os
 import neuralNetwork as nn
-from matplotlib import pyplot as plt
-import piece as pc
 import numpy as np
+import selfPlay as sp
+import profiler as prof
+import gameRecord as gr
+import positionDataset as pds
+
+def fitnessFromResult( result ):
+    """
+    Fitness of the network (player 2) given the outcome of a game
+    """
+    alpha = 100.0
+    numberOfTurns = result["numberOfTurns"]
+    if ( result["winner"] == "p1" ):
+        return np.exp(-alpha/numberOfTurns)
+    elif ( result["winner"] == "p2" ):
+        return np.exp(alpha/numberOfTurns)
+    return 0.5*( np.exp(alpha/numberOfTurns) + np.exp(-alpha/numberOfTurns) )
 
 def main( argv ):
-    if ( len(argv) != 1 ):
-        print ("Usage: trainNetwork.py <numberOfHours>")
+    # Options are given as --name=value or --name. The time spent in each
+    # phase of the games is written to the profile file, all games played are
+    # appended to the record file, and their positions are added to the
+    # dataset directory. A checkpoint is written every autosave generations.
+    # The population of a new network is stored as float16 if --float16 is
+    # given, and it is memory mapped to the population file if given. The
+    # weights are plotted before the training starts if --visualize is given.
+    # The games are played with the piece engine unless --engine=bitboard
+    options = {}
+    for arg in argv:
+        if ( arg.startswith("--") ):
+            name, separator, value = arg[2:].partition("=")
+            options[name] = value
+    argv = [arg for arg in argv if not arg.startswith("--")]
+    profileFile = options.get("profile")
+    recordFile = options.get("record")
+    datasetDirectory = options.get("dataset")
+    autosave = int( options.get("autosave", 1) )
+    if ( autosave < 1 ):
+        print ("--autosave must be at least 1 generation")
+        return
+    populationFile = options.get("populationFile")
+    engine = options.get("engine", "piece")
+    if ( not engine in sp.ENGINES ):
+        print ("Unknown engine %s. Choose one of %s"%(engine, ", ".join(sp.ENGINES.keys())))
+        return
+    populationType = np.float32
+    if ( "float16" in options ):
+        populationType = np.float16
+
+    if ( len(argv) < 1 or len(argv) > 3 ):
+        print ("Usage: trainNetwork.py <numberOfHours> [numberOfProcesses] [gamesPerChromosome] [--profile=<file.json>] [--record=<file>] [--dataset=<directory>] [--autosave=<generations>] [--populationFile=<file>] [--float16] [--engine=piece|bitboard] [--visualize]")
         return
 
-    fname = "trainedNetwork.pkl"
+    numberOfProcesses = None
+    if ( len(argv) >= 2 ):
+        numberOfProcesses = int(argv[1])
+    gamesPerChromosome = 4
+    if ( len(argv) == 3 ):
+        gamesPerChromosome = int(argv[2])
+
+    fname = "trainedNetwork.npz"
 
-    try:
-        networkfile = open(fname, 'rb')
-        network = pck.load( networkfile )
-    except Exception as exc:
-        print (str(exc))
+    # Networks saved before checkpoints were introduced are pickled. A new
+    # network is only created if neither file exists, such that a file that
+    # can not be loaded is never overwritten by an untrained network
+    if ( os.path.exists(fname) ):
+        network = nn.loadNetwork( fname, populationFile=populationFile )
+    elif ( os.path.exists("trainedNetwork.pkl") ):
+        network = nn.loadNetwork( "trainedNetwork.pkl" )
+    else:
+        print ("No trained network found. Starting from a new network")
         neurons = [5*64,0.2*5*64,1]
-        network = nn.Network( neurons )
-    network.visualize()
-    plt.show()
+        network = nn.Network( neurons, populationFile=populationFile, populationType=populationType )
+    if ( "visualize" in options ):
+        from matplotlib import pyplot as plt
+        network.visualize()
+        plt.show()
 
-    numberOfWeightUpdates = 0
     starttime = time.time()
+    endTime = starttime + float(argv[0])*3600
     gameResult = "draw"
-    generateNewInitialState = True
-    gameFname = "lastInitialState.pck"
     fitness = 0.0
     pNNVictories = 0
     pOpponentVictory = 0
     draws = 0
-    while( time.time() -starttime < float(argv[0])*3600 ):
-        diffSec = time.time() -starttime
-        print ("Run for: %d min. End at %d min. Last game: %s, Fitness=%.8E"%(diffSec/60, float(argv[0])*60,gameResult,fitness), end="\r")
-        game = gm.Game()
-        game.setupGame()
-
-        singleGameStartTime = time.time()
-
-        # Change to neural network players
-        #game.p1.setNeuralNetwork( network, game )
-        game.p2.setNeuralNetwork( network, game )
+    generationsCompleted = 0
+    recordWriter = None
+    if ( not recordFile is None ):
+        recordWriter = gr.GameRecordWriter( recordFile )
+    datasetWriter = None
+    if ( not datasetDirectory is None ):
+        datasetWriter = pds.PositionDatasetWriter( datasetDirectory )
+    evaluation = None
+    runner = sp.SelfPlayRunner( numberOfProcesses, initializer=sp.initNetworkWorker, initargs=(sp.evaluationCopy(network),not profileFile is None,not datasetWriter is None,engine) )
+    while( time.time() < endTime ):
+        # Play the remaining chromosomes of the current generation in parallel.
+        # All chromosomes play the same games, and the fitness values are
+        # passed to the GA in chromosome order.
+        ga = network.ga
+        # The seeds are drawn from the GA's generator once per generation. A
+        # generation that was interrupted continues with the seeds and the
+        # results stored in the checkpoint, such that it plays the same games
+        if ( network.evaluationState is None ):
+            seeds = [int(seed) for seed in ga.rng.integers(0,2**31-1,size=gamesPerChromosome)]
+            evaluation = sp.GenerationEvaluation( range(ga.currentChromosome,ga.populationSize), seeds )
+        else:
+            evaluation = sp.restoreEvaluation( network.evaluationState )
+            network.evaluationState = None
+        nextChromosome = ga.currentChromosome
+        for task, result in runner.run( sp.playEvaluationGame, evaluation.tasks( ga.chromosome ), endTime=endTime ):
+            if ( result["winner"] == "p1" ):
+                # Our player loose
+                gameResult = "p1  "
+                pOpponentVictory += 1
+            elif ( result["winner"] == "p2" ):
+                # Our player wins
+                gameResult = "p2  "
+                pNNVictories += 1
+            else:
+                draws += 1
+                gameResult = "draw"
+            if ( not recordWriter is None ):
+                recordWriter.write( result["moves"], result["winner"] )
+            if ( not datasetWriter is None ):
+                datasetWriter.addPositions( *result["positions"] )
+            if ( "profile" in result ):
+                prof.PROFILER.merge( result["profile"] )
+            fitness = fitnessFromResult( result )
+            evaluation.addResult( task, fitness )
+            diffSec = time.time() -starttime
+            print ("Run for: %d min. End at %d min. Last game: %s, Fitness=%.8E, Stopped early: %d"%(diffSec/60, float(argv[0])*60,gameResult,fitness,len(evaluation.stopped)), end="\r")
 
-        counter = 0
-        randomStepCounter = 0
-        while ( game.state != "finished" ):
-            game.stepGame()
-            counter += 1
-            if ( counter >= 4 ):
-                game.p1.setNeuralNetwork( network, game )
+        while ( nextChromosome < ga.populationSize and evaluation.isFinished(nextChromosome) ):
+            network.perturbNext( evaluation.averageFitness(nextChromosome) )
+            nextChromosome += 1
 
-        singleGameTime = time.time() - singleGameStartTime
+        if ( nextChromosome == ga.populationSize ):
+            generationsCompleted += 1
+            if ( generationsCompleted%autosave == 0 ):
+                network.saveCheckpoint( fname )
+    runner.close()
+    if ( not recordWriter is None ):
+        recordWriter.close()
+        print ("%d games appended to %s"%(recordWriter.numberOfGames, recordFile))
+    if ( not datasetWriter is None ):
+        datasetWriter.close()
+        print ("%d positions added to %s"%(datasetWriter.numberOfPositions, datasetDirectory))
 
-        alpha = 100.0
-        if ( game.p1.winner ):
-            # Our player loose
-            gameResult = "p1  "
-            pOpponentVictory += 1
-            fitness = np.exp(-alpha/game.numberOfTurns)
-        elif ( game.p2.winner ):
-            # Our player wins
-            fitness = np.exp(alpha/game.numberOfTurns)
-            gameResult = "p2  "
-            pNNVictories += 1
-        else:
-            fitness = 0.5*( np.exp(alpha/game.numberOfTurns) + np.exp(-alpha/game.numberOfTurns) )
-            draws += 1
-            gameResult = "draw"
-        network.perturbNext( fitness )
-
-    network.save(fname)
+    # The results of an unfinished generation are stored with the network
+    evaluationState = network.evaluationState
+    if ( not evaluation is None and nextChromosome < network.ga.populationSize ):
+        evaluationState = evaluation.toArrays()
+    network.saveCheckpoint( fname, evaluationState=evaluationState )
     print ("Newly trained network saved to %s"%(fname))
 
     totGames = pNNVictories+pOpponentVictory+draws
@@ -83,5 +164,9 @@ def main( argv ):
     print ("Draw: %d (%.2f per cent)"%(draws,draws*100.0/totGames))
     print ("==========================================")
 
+    if ( not profileFile is None ):
+        prof.PROFILER.printOut()
+        prof.PROFILER.save( profileFile )
+
 if __name__ == "__main__":
     main( sys.argv[1:] )
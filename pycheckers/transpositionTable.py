@@ -0,0 +1,86 @@
+import numpy as np
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+class TranspositionTable:
+    """
+    Fixed size hash table storing search results for positions identified
+    by their Zobrist hash. The size is given by the memory cap
+    """
+    def __init__( self, maxMemoryInMB=64 ):
+        bytesPerEntry = 8+8+1+1+1+2
+        self.numberOfEntries = max( 1, int(maxMemoryInMB*1024*1024/bytesPerEntry) )
+        self.keys = np.zeros( self.numberOfEntries, dtype=np.int64 )
+        self.scores = np.zeros( self.numberOfEntries, dtype=np.float64 )
+        self.depths = np.zeros( self.numberOfEntries, dtype=np.int8 )
+        self.flags = np.zeros( self.numberOfEntries, dtype=np.int8 )
+        self.ages = np.zeros( self.numberOfEntries, dtype=np.uint8 )
+        self.bestMoves = np.zeros( self.numberOfEntries, dtype=np.int16 )-1
+
+        # Entries stored during an earlier search can always be replaced
+        self.age = 1
+
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def newSearch( self ):
+        """
+        Mark the entries stored so far as old
+        """
+        self.age = self.age%255 + 1
+
+    def clear( self ):
+        self.ages[:] = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def encodeMove( self, fromX, fromY, toX, toY ):
+        return (fromX*8+fromY)*64 + toX*8+toY
+
+    def decodeMove( self, code ):
+        frm, to = divmod( int(code), 64 )
+        return frm//8, frm%8, to//8, to%8
+
+    def probe( self, key ):
+        """
+        Return (score, depth, flag, bestMove) stored for the position, or None
+        if it is not in the table
+        """
+        self.probes += 1
+        indx = key%self.numberOfEntries
+        if ( self.ages[indx] == 0 or self.keys[indx] != key ):
+            return None
+        self.hits += 1
+        return self.scores[indx], self.depths[indx], self.flags[indx], self.bestMoves[indx]
+
+    def store( self, key, score, depth, flag, bestMove ):
+        """
+        Store a search result. An entry from the current search is only
+        replaced by a result of at least the same depth
+        """
+        indx = key%self.numberOfEntries
+        if ( self.ages[indx] == self.age and self.keys[indx] != key and self.depths[indx] > depth ):
+            return
+        if ( self.ages[indx] != 0 and self.keys[indx] != key ):
+            self.overwrites += 1
+        self.stores += 1
+        self.keys[indx] = key
+        self.scores[indx] = score
+        self.depths[indx] = depth
+        self.flags[indx] = flag
+        self.ages[indx] = self.age
+        self.bestMoves[indx] = bestMove
+
+    def hitRate( self ):
+        if ( self.probes == 0 ):
+            return 0.0
+        return self.hits/self.probes
+
+    def printStatistics( self ):
+        print ("Transposition table: %d entries, %d probes, hit rate %.2f per cent, %d stores, %d overwrites"%(self.numberOfEntries, self.probes, 100.0*self.hitRate(), self.stores, self.overwrites))
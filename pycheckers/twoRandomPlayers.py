@@ -1,34 +1,53 @@
-import gui as pychgui
-import game as gm
+import selfPlay as sp
 import sys
 import time
+import itertools
+import numpy as np
 
 def main( argv ):
     if ( len(argv) == 0 ):
-        print ("Usage: python3 twoRandomPlayer.py <numberofHours>" )
+        print ("Usage: python3 twoRandomPlayer.py <numberofHours> [numberOfProcesses] [piece|bitboard]" )
+        return
+
+    numberOfProcesses = None
+    if ( len(argv) > 1 ):
+        numberOfProcesses = int(argv[1])
+    engine = "piece"
+    if ( len(argv) > 2 ):
+        engine = argv[2]
+    if ( not engine in sp.ENGINES ):
+        print ("Unknown engine %s. Choose one of %s"%(engine, ", ".join(sp.ENGINES.keys())))
         return
 
     useGUI = False
     starttime = time.time()
     gameNumber = 0
-    while( time.time()-starttime < float(argv[0])*3600 ):
-        gameNumber += 1
-        print ("Game: %d"%(gameNumber))
-        if ( useGUI ):
+    if ( useGUI ):
+        import gui as pychgui
+        while( time.time()-starttime < float(argv[0])*3600 ):
+            gameNumber += 1
+            print ("Game: %d"%(gameNumber))
             app = pychgui.PyCheckerGUI()
             app.game.p1.name = "Rnd player"
             app.game.p2.name = "Even more rnd plaer"
             #app.saveLastState = True
             app.play()
-        else:
-            game = gm.Game()
-            game.setupGame()
-            game.p1.name = "Random player"
-            game.p2.name = "Even more random player"
-            while( not game.state == "finished" ):
-                game.stepGame()
+        return
 
-            game.printResult()
+    names = {"p1":"Random player", "p2":"Even more random player"}
+    runner = sp.SelfPlayRunner( numberOfProcesses )
+    # The games reseed the global generator, so the seeds are drawn from a
+    # generator of their own
+    rng = np.random.default_rng()
+    seeds = ((int(rng.integers(0,2**31-1)),engine) for i in itertools.count())
+    for task, result in runner.run( sp.playRandomGame, seeds, endTime=starttime+float(argv[0])*3600 ):
+        gameNumber += 1
+        print ("Game: %d"%(gameNumber))
+        if ( result["winner"] == "draw" ):
+            print ("Ended with draw!")
+        else:
+            print ("Player: %s won"%(names[result["winner"]]))
+    runner.close()
 
 if __name__ == "__main__":
     main( sys.argv[1:] )